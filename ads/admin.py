@@ -1,11 +1,65 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
-# Register your models here.
 from ads.models import Ad, Category, Location, AdUser
 
-admin.site.register(Ad)
-admin.site.register(Category)
-admin.site.register(Location)
-admin.site.register(AdUser)
 
+class EstimatedCountPaginator(Paginator):
+    """
+    Для большой таблицы без фильтров берёт оценку числа строк из pg_class
+    вместо точного COUNT(*), который на PostgreSQL читает всю таблицу
+    """
 
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, "query", None)
+        if query is not None and not query.where:
+            connection = connections[self.object_list.db]
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                        [self.object_list.model._meta.db_table]
+                    )
+                    row = cursor.fetchone()
+                if row and row[0] >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                    return row[0]
+        return super().count
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # не считать COUNT(*) по всей таблице рядом с отфильтрованным
+    show_full_result_count = False
+
+
+@admin.register(Ad)
+class AdAdmin(ScalableModelAdmin):
+    list_display = ("id", "name", "price", "author_id", "is_published")
+    list_select_related = ("author_id",)
+    list_filter = ("is_published",)
+    search_fields = ("name__startswith",)
+    autocomplete_fields = ("author_id", "categories")
+
+
+@admin.register(Category)
+class CategoryAdmin(ScalableModelAdmin):
+    list_display = ("id", "name", "is_active")
+    list_filter = ("is_active",)
+    search_fields = ("name__startswith",)
+
+
+@admin.register(Location)
+class LocationAdmin(ScalableModelAdmin):
+    list_display = ("id", "name", "lat", "lng")
+    search_fields = ("name__startswith",)
+
+
+@admin.register(AdUser)
+class AdUserAdmin(ScalableModelAdmin):
+    list_display = ("id", "username", "first_name", "last_name", "role", "age")
+    list_filter = ("role",)
+    search_fields = ("username__startswith",)
@@ -0,0 +1,240 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from array import array
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from ads.models import Ad, ad_location_name
+
+COLUMNS = ["ad_id", "price", "location", "is_published", "author_id"]
+PAIR_COLUMNS = ["pair_ad_id", "pair_category_id"]
+META_FILE = "meta.json"
+
+
+class Snapshot:
+    """
+    Колоночный снимок объявлений для аналитики цен: по массиву NumPy на
+    колонку, отсортированных по ad_id. Адрес хранится кодом в списке
+    locations, у категорий (M2M) отдельные массивы пар (ad_id, category_id)
+    """
+
+    def __init__(self, columns, meta):
+        self.columns = columns
+        self.meta = meta
+        self.locations = meta["locations"]
+        # строка объявления для каждой пары категории
+        self.pair_row = np.searchsorted(columns["ad_id"], columns["pair_ad_id"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @classmethod
+    def load(cls, directory, meta):
+        path = os.path.join(directory, meta["generation"])
+        columns = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in COLUMNS + PAIR_COLUMNS
+        }
+        return cls(columns, meta)
+
+
+def read_meta(directory):
+    try:
+        with open(os.path.join(directory, META_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_snapshot(directory, columns, locations, watermark):
+    """
+    Пишет новое поколение файлов и атомарно переключает на него meta.json
+    """
+    generation = f"g-{uuid.uuid4().hex[:12]}"
+    path = os.path.join(directory, generation)
+    os.makedirs(path)
+    for name, values in columns.items():
+        np.save(os.path.join(path, f"{name}.npy"), values)
+
+    previous = read_meta(directory)
+    meta = {"generation": generation, "watermark": watermark.isoformat(), "locations": locations}
+    tmp = os.path.join(directory, f"{META_FILE}.{generation}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(directory, META_FILE))
+
+    # предыдущее поколение оставляем: его мог только что прочитать другой процесс
+    keep = {generation, previous["generation"] if previous else None}
+    for name in os.listdir(directory):
+        if name.startswith("g-") and name not in keep:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return meta
+
+
+def fetch_ads(ads, location_codes, locations):
+    """
+    Один проход по выборке объявлений в типизированные array, без моделей.
+    Адрес -- свой или, если он не указан, адрес автора
+    """
+    ad_id, price, location, is_published, author_id = array("q"), array("q"), array("i"), array("b"), array("q")
+    rows = ads.order_by().values_list("id", "price", ad_location_name(), "is_published", "author_id_id")
+    for pk, ad_price, location_name, published, author in rows.iterator(chunk_size=settings.ANALYTICS_CHUNK_SIZE):
+        code = -1
+        if location_name is not None:
+            code = location_codes.get(location_name)
+            if code is None:
+                code = location_codes[location_name] = len(locations)
+                locations.append(location_name)
+        ad_id.append(pk)
+        price.append(ad_price)
+        location.append(code)
+        is_published.append(published)
+        author_id.append(author if author is not None else -1)
+
+    return {
+        "ad_id": np.frombuffer(ad_id, dtype=np.int64),
+        "price": np.frombuffer(price, dtype=np.int64).astype(np.uint32),
+        "location": np.frombuffer(location, dtype=np.int32),
+        "is_published": np.frombuffer(is_published, dtype=np.int8).astype(bool),
+        "author_id": np.frombuffer(author_id, dtype=np.int64),
+    }
+
+
+def fetch_pairs(ad_ids=None):
+    through = Ad.categories.through.objects.order_by()
+    if ad_ids is not None:
+        through = through.filter(ad_id__in=ad_ids)
+    pair_ad_id, pair_category_id = array("q"), array("q")
+    for ad, category in through.values_list("ad_id", "category_id").iterator(chunk_size=settings.ANALYTICS_CHUNK_SIZE):
+        pair_ad_id.append(ad)
+        pair_category_id.append(category)
+    return {
+        "pair_ad_id": np.frombuffer(pair_ad_id, dtype=np.int64),
+        "pair_category_id": np.frombuffer(pair_category_id, dtype=np.int64),
+    }
+
+
+def refresh(directory=None, full=False):
+    """
+    Обновляет снимок: перечитывает из БД только объявления с updated_at после
+    прошлого обновления (с запасом ANALYTICS_REFRESH_OVERLAP на долгие
+    транзакции), удалённые находит по списку id. full=True -- снимок с нуля
+    """
+    directory = directory or settings.ANALYTICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    started = timezone.now()
+    meta = None if full else read_meta(directory)
+
+    if meta is None:
+        locations = []
+        columns = fetch_ads(Ad.objects.all(), {}, locations)
+        columns.update(fetch_pairs())
+    else:
+        old = Snapshot.load(directory, meta)
+        locations = list(meta["locations"])
+        location_codes = {name: code for code, name in enumerate(locations)}
+
+        since = parse_datetime(meta["watermark"]) - timedelta(seconds=settings.ANALYTICS_REFRESH_OVERLAP)
+        changed = fetch_ads(Ad.objects.filter(updated_at__gte=since), location_codes, locations)
+        current_ids = np.fromiter(
+            Ad.objects.order_by().values_list("id", flat=True).iterator(chunk_size=settings.ANALYTICS_CHUNK_SIZE),
+            dtype=np.int64
+        )
+
+        keep = np.isin(old["ad_id"], current_ids) & ~np.isin(old["ad_id"], changed["ad_id"])
+        columns = {name: np.concatenate([old[name][keep], changed[name]]) for name in COLUMNS}
+
+        keep_pairs = np.isin(old["pair_ad_id"], old["ad_id"][keep])
+        changed_pairs = {name: [] for name in PAIR_COLUMNS}
+        changed_ids = changed["ad_id"].tolist()
+        for start in range(0, len(changed_ids), settings.ANALYTICS_CHUNK_SIZE):
+            chunk = fetch_pairs(changed_ids[start:start + settings.ANALYTICS_CHUNK_SIZE])
+            for name in PAIR_COLUMNS:
+                changed_pairs[name].append(chunk[name])
+        for name in PAIR_COLUMNS:
+            columns[name] = np.concatenate([old[name][keep_pairs]] + changed_pairs[name])
+
+    order = np.argsort(columns["ad_id"], kind="stable")
+    for name in COLUMNS:
+        columns[name] = columns[name][order]
+
+    # объявления и их категории читаются разными запросами: связи объявления,
+    # созданного между ними, отбрасываем -- оно целиком попадёт в следующее
+    # обновление, его updated_at позже отметки started
+    known = np.isin(columns["pair_ad_id"], columns["ad_id"])
+    for name in PAIR_COLUMNS:
+        columns[name] = columns[name][known]
+
+    return write_snapshot(directory, columns, locations, started)
+
+
+_cache_lock = threading.Lock()
+_cache = {"generation": None, "snapshot": None}
+
+
+def current_snapshot(directory=None):
+    """
+    Снимок для текущего процесса, перечитывается при смене поколения в meta.json
+    """
+    directory = directory or settings.ANALYTICS_DIR
+    meta = read_meta(directory)
+    if meta is None:
+        return None
+    with _cache_lock:
+        if _cache["generation"] != meta["generation"]:
+            _cache["snapshot"] = Snapshot.load(directory, meta)
+            _cache["generation"] = meta["generation"]
+        return _cache["snapshot"]
+
+
+def grouped_stats(prices, groups, percentiles, bins):
+    """
+    Перцентили (линейная интерполяция, как np.percentile), среднее и гистограмма
+    цен по группам -- без цикла по группам, одной сортировкой
+    """
+    if len(prices) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros((0, len(percentiles))),
+                np.zeros(0), np.zeros((0, bins), dtype=np.int64), np.zeros(0))
+
+    order = np.lexsort((prices, groups))
+    groups = groups[order]
+    prices = prices[order].astype(np.float64)
+    keys, starts, counts = np.unique(groups, return_index=True, return_counts=True)
+
+    position = starts[:, None] + np.asarray(percentiles, dtype=np.float64)[None, :] / 100 * (counts[:, None] - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, (starts + counts - 1)[:, None])
+    values = prices[lower] + (prices[upper] - prices[lower]) * (position - lower)
+
+    means = np.add.reduceat(prices, starts) / counts
+
+    edges = np.histogram_bin_edges(prices, bins=bins)
+    bin_index = np.clip(np.searchsorted(edges, prices, side="right") - 1, 0, bins - 1)
+    group_index = np.repeat(np.arange(len(keys)), counts)
+    histogram = np.bincount(group_index * bins + bin_index, minlength=len(keys) * bins).reshape(len(keys), bins)
+
+    return keys, counts, values, means, histogram, edges
+
+
+def price_stats(snapshot, by, percentiles, bins, published=True):
+    prices = snapshot["price"]
+    if by == "category":
+        rows = snapshot.pair_row
+        mask = snapshot["is_published"][rows] if published else np.ones(len(rows), dtype=bool)
+        groups = snapshot["pair_category_id"][mask]
+        prices = prices[rows[mask]]
+    else:
+        mask = snapshot["location"] >= 0
+        if published:
+            mask &= snapshot["is_published"]
+        groups = snapshot["location"][mask]
+        prices = prices[mask]
+
+    return grouped_stats(prices, groups, percentiles, bins)
@@ -0,0 +1,243 @@
+import csv
+import hashlib
+import json
+import os
+from collections import Counter
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ads.models import Category, Location, AdUser, Ad, DatasetRowChecksum
+
+
+def fit(model, field_name, value):
+    """
+    Обрезает строку под max_length поля: в датасетах есть названия длиннее,
+    чем допускает модель, а PostgreSQL такие строки не примет
+    """
+    max_length = model._meta.get_field(field_name).max_length
+    if value and max_length:
+        return value[:max_length]
+    return value
+
+
+def checksum(values):
+    payload = json.dumps(values, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+class Dataset:
+    """
+    Описание одного CSV: модель, колонка с id и преобразование строки в поля
+    модели. Контрольная сумма считается от уже преобразованных полей, так что
+    изменение связанных данных (например, названия адреса у пользователя) тоже
+    считается изменением строки
+    """
+    name = None
+    model = None
+    id_column = "id"
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, f"{self.name}.csv")
+
+    def read(self):
+        with open(self.path, encoding="utf-8", newline="") as f:
+            yield from csv.DictReader(f)
+
+    def convert(self, row):
+        raise NotImplementedError
+
+    def categories(self, row):
+        return None
+
+    def changed(self, row_ids):
+        """
+        Вызывается для пачки вставленных или изменённых строк
+        """
+
+
+class CategoryDataset(Dataset):
+    name = "category"
+    model = Category
+
+    def convert(self, row):
+        return {"name": fit(Category, "name", row["name"])}
+
+
+class LocationDataset(Dataset):
+    name = "location"
+    model = Location
+
+    def convert(self, row):
+        return {
+            "name": fit(Location, "name", row["name"]),
+            "lat": float(row["lat"]) if row["lat"] else None,
+            "lng": float(row["lng"]) if row["lng"] else None,
+        }
+
+
+class UserDataset(Dataset):
+    name = "user"
+    model = AdUser
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        # в модели пользователя адрес хранится текстом
+        self.locations = {row["id"]: row["name"] for row in LocationDataset(directory).read()}
+
+    def convert(self, row):
+        return {
+            "first_name": fit(AdUser, "first_name", row["first_name"]),
+            "last_name": fit(AdUser, "last_name", row["last_name"]),
+            "username": fit(AdUser, "username", row["username"]),
+            "password": fit(AdUser, "password", row["password"]),
+            "role": row["role"],
+            "age": int(row["age"]),
+            "location_name": self.locations.get(row["location_id"]),
+        }
+
+    def changed(self, row_ids):
+        # у объявлений без своего адреса адрес берётся от автора, для снимка
+        # цен они тоже изменились (обработчики сигналов на время загрузки отключены)
+        Ad.objects.filter(author_id__in=row_ids, location_name=None).update(updated_at=timezone.now())
+
+
+class AdDataset(Dataset):
+    name = "ad"
+    model = Ad
+    id_column = "Id"
+
+    def convert(self, row):
+        return {
+            "name": fit(Ad, "name", row["name"]),
+            "author_id_id": int(row["author_id"]) if row["author_id"] else None,
+            "price": int(row["price"]),
+            "description": row["description"],
+            "is_published": row["is_published"].upper() == "TRUE",
+            "logo": row["image"] or None,
+        }
+
+    def categories(self, row):
+        return [int(row["category_id"])] if row["category_id"] else []
+
+
+# порядок важен: сначала справочники, потом то, что на них ссылается
+DATASETS = [CategoryDataset, LocationDataset, UserDataset, AdDataset]
+
+
+class DatasetSync:
+    """
+    Загрузка датасетов в БД. Каждая пачка строк вместе с их контрольными
+    суммами пишется в отдельной транзакции, поэтому после падения повторный
+    запуск пропустит уже загруженные пачки и продолжит с места остановки
+    """
+
+    def __init__(self, directory, batch_size=1000, names=None):
+        self.datasets = [
+            dataset(directory) for dataset in DATASETS
+            if names is None or dataset.name in names
+        ]
+        self.batch_size = batch_size
+        self.stats = {dataset.name: Counter() for dataset in self.datasets}
+
+    def truncate(self):
+        with transaction.atomic():
+            for dataset in reversed(self.datasets):
+                dataset.model.objects.all().delete()
+                DatasetRowChecksum.objects.filter(dataset=dataset.name).delete()
+
+    def run(self):
+        missing = {}
+        for dataset in self.datasets:
+            missing[dataset.name] = self.upsert(dataset)
+
+        # удаляем в обратном порядке, чтобы не упереться во внешние ключи
+        for dataset in reversed(self.datasets):
+            self.delete(dataset, missing[dataset.name])
+
+        self.reset_sequences()
+        return self.stats
+
+    def upsert(self, dataset):
+        stored = dict(
+            DatasetRowChecksum.objects.filter(dataset=dataset.name).values_list("row_id", "checksum")
+        )
+        seen = set()
+        batch = []
+        for row in dataset.read():
+            row_id = int(row[dataset.id_column])
+            seen.add(row_id)
+            values = dataset.convert(row)
+            categories = dataset.categories(row)
+            row_checksum = checksum([values, categories])
+            if stored.get(row_id) == row_checksum:
+                self.stats[dataset.name]["unchanged"] += 1
+                continue
+
+            batch.append((row_id, values, categories, row_checksum))
+            if len(batch) >= self.batch_size:
+                self.apply(dataset, batch, stored)
+                batch = []
+
+        if batch:
+            self.apply(dataset, batch, stored)
+
+        return [row_id for row_id in stored if row_id not in seen]
+
+    @transaction.atomic
+    def apply(self, dataset, batch, stored):
+        model = dataset.model
+        fields = list(batch[0][1])
+        # auto_now bulk_create проставляет сам, но при конфликте его нужно обновить явно
+        fields += [field.name for field in model._meta.concrete_fields if getattr(field, "auto_now", False)]
+        model.objects.bulk_create(
+            [model(pk=row_id, **values) for row_id, values, _, _ in batch],
+            update_conflicts=True,
+            unique_fields=["id"],
+            update_fields=fields,
+        )
+        # строка со старой суммой уже была загружена -- значит, обновлена
+        updated = sum(1 for row_id, *_ in batch if row_id in stored)
+        self.stats[dataset.name]["inserted"] += len(batch) - updated
+        self.stats[dataset.name]["updated"] += updated
+
+        if any(categories is not None for _, _, categories, _ in batch):
+            self.set_categories(batch)
+        dataset.changed([row_id for row_id, *_ in batch])
+
+        DatasetRowChecksum.objects.bulk_create(
+            [
+                DatasetRowChecksum(dataset=dataset.name, row_id=row_id, checksum=row_checksum)
+                for row_id, _, _, row_checksum in batch
+            ],
+            update_conflicts=True,
+            unique_fields=["dataset", "row_id"],
+            update_fields=["checksum"],
+        )
+
+    def set_categories(self, batch):
+        through = Ad.categories.through
+        known = set(Category.objects.values_list("pk", flat=True))
+        through.objects.filter(ad_id__in=[row_id for row_id, *_ in batch]).delete()
+        through.objects.bulk_create([
+            through(ad_id=row_id, category_id=category_id)
+            for row_id, _, categories, _ in batch
+            for category_id in categories
+            if category_id in known
+        ])
+
+    def delete(self, dataset, row_ids):
+        for start in range(0, len(row_ids), self.batch_size):
+            chunk = row_ids[start:start + self.batch_size]
+            with transaction.atomic():
+                dataset.model.objects.filter(pk__in=chunk).delete()
+                DatasetRowChecksum.objects.filter(dataset=dataset.name, row_id__in=chunk).delete()
+            self.stats[dataset.name]["deleted"] += len(chunk)
+
+    def reset_sequences(self):
+        # строки вставлены с явными id, сдвигаем последовательности PostgreSQL
+        statements = connection.ops.sequence_reset_sql(no_style(), [dataset.model for dataset in self.datasets])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
@@ -0,0 +1,164 @@
+import hashlib
+import random
+import re
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from ads.models import Ad, AdSignature, AdBandHash
+from ads.suggest import fold
+
+WORD_RE = re.compile(r"\w+")
+SHINGLE_SIZE = 5
+MERSENNE_PRIME = (1 << 61) - 1
+
+# параметры хэш-функций фиксированы: сигнатуры в БД должны оставаться сравнимыми.
+# При смене MINHASH_PERMUTATIONS/MINHASH_BANDS нужно find_duplicates --reindex
+_random = random.Random(20230101)
+PERMUTATIONS = [
+    (_random.randrange(1, MERSENNE_PRIME), _random.randrange(0, MERSENNE_PRIME))
+    for _ in range(settings.MINHASH_PERMUTATIONS)
+]
+ROWS_PER_BAND = settings.MINHASH_PERMUTATIONS // settings.MINHASH_BANDS
+
+_P = np.uint64(MERSENNE_PRIME)
+_A = np.array([a for a, _ in PERMUTATIONS], dtype=np.uint64)[:, None]
+_B = np.array([b for _, b in PERMUTATIONS], dtype=np.uint64)[:, None]
+_LOW32 = np.uint64(0xFFFFFFFF)
+
+
+def ad_text(ad):
+    return f"{ad.name} {ad.description or ''}"
+
+
+def shingles(text):
+    """
+    Символьные 5-граммы нормализованного текста: регистр, ё/е, пунктуация и
+    пробелы не влияют на сходство
+    """
+    normalized = " ".join(WORD_RE.findall(fold(text)))
+    if len(normalized) <= SHINGLE_SIZE:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def _reduce(x):
+    """
+    x mod (2**61 - 1) для x < 2**63: 2**61 по этому модулю равно 1
+    """
+    x = (x & _P) + (x >> np.uint64(61))
+    # при x < P разность переполняется и minimum оставляет x
+    return np.minimum(x, x - _P)
+
+
+def _mulmod(a, h):
+    """
+    a * h mod (2**61 - 1) для a, h < 2**61 без 128-битных чисел: множители
+    делим на 32-битные половины и сворачиваем части произведения по модулю
+    """
+    shift = np.uint64(32)
+    a_lo, a_hi = a & _LOW32, a >> shift
+    h_lo, h_hi = h & _LOW32, h >> shift
+    low = a_lo * h_lo
+    mid = a_lo * h_hi + a_hi * h_lo
+    high = a_hi * h_hi
+    # high * 2**64 = 8 * high * 2**61, mid * 2**32 = (mid >> 29) * 2**61 + (mid mod 2**29) * 2**32
+    total = (
+        (high << np.uint64(3))
+        + (mid >> np.uint64(29)) + ((mid & np.uint64((1 << 29) - 1)) << shift)
+        + (low >> np.uint64(61)) + (low & _P)
+    )
+    return _reduce(total)
+
+
+def signature(text):
+    """
+    MinHash: минимум (a * h + b) mod (2**61 - 1) по шинглам для каждой из
+    PERMUTATIONS, сразу для всех перестановок матрицей NumPy
+    """
+    hashes = np.fromiter(
+        (_hash64(shingle.encode()) for shingle in shingles(text)), dtype=np.uint64
+    )
+    if not len(hashes):
+        return None
+    values = _reduce(_mulmod(_A, _reduce(hashes)[None, :]) + _B)
+    return (values.min(axis=1) & _LOW32).astype(np.uint32)
+
+
+def band_hash(minhash, band):
+    rows = minhash[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+    # BigIntegerField знаковый
+    return int.from_bytes(hashlib.blake2b(rows.tobytes(), digest_size=8).digest(), "little", signed=True)
+
+
+def band_hashes(minhash):
+    for band in range(settings.MINHASH_BANDS):
+        yield band, band_hash(minhash, band)
+
+
+def unpack(data):
+    return np.frombuffer(bytes(data), dtype=np.uint32)
+
+
+def similarity(first, second):
+    return np.count_nonzero(first == second) / len(first)
+
+
+def build_rows(ad):
+    """
+    Строки AdSignature и AdBandHash для объявления, None -- если текста нет
+    """
+    minhash = signature(ad_text(ad))
+    if minhash is None:
+        return None, []
+    return (
+        AdSignature(ad_id=ad.pk, minhash=minhash.tobytes()),
+        [AdBandHash(ad_id=ad.pk, band=band, hash=value) for band, value in band_hashes(minhash)]
+    )
+
+
+def update_signature(ad):
+    sig, bands = build_rows(ad)
+    with transaction.atomic():
+        AdBandHash.objects.filter(ad_id=ad.pk).delete()
+        if sig is None:
+            AdSignature.objects.filter(ad_id=ad.pk).delete()
+            return
+        AdSignature.objects.update_or_create(ad_id=ad.pk, defaults={"minhash": sig.minhash})
+        AdBandHash.objects.bulk_create(bands)
+
+
+def similar_ads(ad, threshold, limit):
+    """
+    Похожие объявления: кандидаты по совпадению хэша полосы (индекс band, hash),
+    затем отбор по оценке коэффициента Жаккара из сигнатур
+    """
+    data = AdSignature.objects.filter(ad_id=ad.pk).values_list("minhash", flat=True).first()
+    # сигнатуры нет, если объявление ещё не проиндексировано
+    minhash = unpack(data) if data is not None else signature(ad_text(ad))
+    if minhash is None:
+        return []
+
+    condition = Q()
+    for band, value in band_hashes(minhash):
+        condition |= Q(band=band, hash=value)
+    candidate_ids = set(
+        AdBandHash.objects.filter(condition).exclude(ad_id=ad.pk).values_list("ad_id", flat=True)
+    )
+
+    scored = []
+    for ad_id, data in AdSignature.objects.filter(ad_id__in=candidate_ids).values_list("ad_id", "minhash"):
+        score = similarity(minhash, unpack(data))
+        if score >= threshold:
+            scored.append((score, ad_id))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    scored = scored[:limit]
+
+    ads = Ad.objects.in_bulk([ad_id for _, ad_id in scored])
+    return [(ads[ad_id], score) for score, ad_id in scored if ad_id in ads]
@@ -0,0 +1,125 @@
+import threading
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.http import JsonResponse
+
+# SQLSTATE query_canceled: запрос прерван по statement_timeout
+QUERY_CANCELED = "57014"
+
+
+class EndpointLimiter:
+    """
+    Ограничение числа одновременных запросов одного класса эндпоинтов
+    в процессе. Свободного слота нет -- запрос сразу получает 503
+    """
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self._semaphore = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self.stats = {"in_flight": 0, "rejected": 0, "timeouts": 0}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def acquire(self):
+        if not self._semaphore.acquire(blocking=False):
+            self.incr("rejected")
+            return False
+        self.incr("in_flight")
+        return True
+
+    def release(self):
+        self.incr("in_flight", -1)
+        self._semaphore.release()
+
+
+limiters = {
+    name: EndpointLimiter(config["concurrency"])
+    for name, config in settings.ENDPOINT_LIMITS.items()
+}
+
+
+def endpoint_class(request, view_func):
+    """
+    Класс эндпоинта: атрибут endpoint_class у класса вьюхи или у функции
+    (None -- без ограничений), по умолчанию read для безопасных методов и write
+    для остальных
+    """
+    view = getattr(view_func, "view_class", view_func)
+    if hasattr(view, "endpoint_class"):
+        return view.endpoint_class
+    return "read" if request.method in ("GET", "HEAD", "OPTIONS") else "write"
+
+
+def overloaded(message):
+    response = JsonResponse({"error": message}, status=503)
+    response["Retry-After"] = settings.LOAD_SHEDDING_RETRY_AFTER
+    return response
+
+
+def statement_timeout(name, view_func):
+    view = getattr(view_func, "view_class", view_func)
+    return getattr(view, "statement_timeout", settings.ENDPOINT_LIMITS[name]["statement_timeout"])
+
+
+def run_limited(name, timeout, call):
+    """
+    Вызов вьюхи в слоте класса эндпоинтов name и с бюджетом времени на SQL
+    (SET LOCAL statement_timeout в транзакции запроса, только PostgreSQL)
+    """
+    limiter = limiters[name]
+    if not limiter.acquire():
+        return overloaded("Service overloaded, retry later")
+
+    connection = connections[DEFAULT_DB_ALIAS]
+    use_timeout = timeout and connection.vendor == "postgresql"
+    try:
+        with transaction.atomic() if use_timeout else nullcontext():
+            if use_timeout:
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL statement_timeout = %s", [int(timeout)])
+            return call()
+    except OperationalError as e:
+        if getattr(e.__cause__, "pgcode", None) != QUERY_CANCELED:
+            raise
+        limiter.incr("timeouts")
+        return overloaded("Query timeout, retry later")
+    finally:
+        limiter.release()
+
+
+def is_coalesced(request, view_func):
+    view_class = getattr(view_func, "view_class", None)
+    handler = getattr(view_class, "get", None) if view_class else view_func
+    return request.method == "GET" and getattr(handler, "coalesced", False)
+
+
+class LoadSheddingMiddleware:
+    """
+    Сбрасывает нагрузку: лимит одновременных запросов на класс эндпоинтов и
+    бюджет времени на SQL, см. run_limited. Вьюху вызывает сам, поэтому должен
+    стоять последним в MIDDLEWARE. Для вьюх с @coalesce лимит применяет только
+    лидер схлопывания (request.endpoint_limit), ждущие слот не занимают
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        name = endpoint_class(request, view_func)
+        if name is None:
+            return None
+
+        timeout = statement_timeout(name, view_func)
+        if is_coalesced(request, view_func):
+            request.endpoint_limit = (name, timeout)
+            return None
+
+        return run_limited(name, timeout, lambda: view_func(request, *view_args, **view_kwargs))
@@ -0,0 +1,119 @@
+from itertools import combinations
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ads.duplicates import ROWS_PER_BAND, band_hash, build_rows, similarity, unpack
+from ads.models import Ad, AdSignature, AdBandHash
+
+
+class Command(BaseCommand):
+    help = "Ищет пары похожих объявлений по LSH-индексу, при необходимости достраивая его"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--index", action="store_true", help="посчитать сигнатуры объявлений, у которых их нет")
+        parser.add_argument("--reindex", action="store_true", help="пересчитать сигнатуры всех объявлений")
+        parser.add_argument("--threshold", type=float, default=settings.DUPLICATE_THRESHOLD)
+        parser.add_argument("--max-bucket", type=int, default=100,
+                            help="пропускать корзины LSH крупнее, это шаблонные тексты")
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options["index"] or options["reindex"]:
+            self.build_index(options["reindex"], options["batch_size"])
+
+        # ключи (band, hash) пропущенных корзин, их не больше строк / max_bucket
+        self.oversized = set()
+        candidates = found = 0
+        for buckets in self.bucket_batches(options["max_bucket"], options["batch_size"]):
+            ids = {ad_id for _, bucket in buckets for ad_id in bucket}
+            signatures = {
+                ad_id: unpack(data)
+                for ad_id, data in AdSignature.objects.filter(ad_id__in=ids).values_list("ad_id", "minhash")
+            }
+            for band, bucket in buckets:
+                for first, second in combinations(bucket, 2):
+                    if first not in signatures or second not in signatures:
+                        continue
+                    if self.met_in_earlier_band(band, signatures[first], signatures[second]):
+                        continue
+                    candidates += 1
+                    score = similarity(signatures[first], signatures[second])
+                    if score >= options["threshold"]:
+                        found += 1
+                        self.stdout.write(f"{first}\t{second}\t{score:.3f}")
+
+        self.stderr.write(f"Кандидатов: {candidates}")
+        self.stderr.write(f"Похожих пар: {found}")
+
+    def build_index(self, reindex, batch_size):
+        ads = Ad.objects.order_by("pk").only("pk", "name", "description")
+        if reindex:
+            AdBandHash.objects.all().delete()
+            AdSignature.objects.all().delete()
+        else:
+            ads = ads.filter(adsignature__isnull=True)
+
+        batch = []
+        for ad in ads.iterator(chunk_size=batch_size):
+            batch.append(ad)
+            if len(batch) >= batch_size:
+                self.save_rows(batch)
+                batch = []
+        if batch:
+            self.save_rows(batch)
+
+    @transaction.atomic
+    def save_rows(self, ads):
+        signatures, bands = [], []
+        for ad in ads:
+            sig, ad_bands = build_rows(ad)
+            if sig is not None:
+                signatures.append(sig)
+                bands.extend(ad_bands)
+        AdBandHash.objects.filter(ad_id__in=[ad.pk for ad in ads]).delete()
+        AdSignature.objects.filter(ad_id__in=[ad.pk for ad in ads]).delete()
+        AdSignature.objects.bulk_create(signatures)
+        AdBandHash.objects.bulk_create(bands)
+
+    def bucket_batches(self, max_bucket, batch_size):
+        """
+        Один проход по индексу (band, hash): подряд идущие строки с одинаковым
+        ключом образуют корзину, все пары внутри корзины -- кандидаты. Корзины
+        отдаются пачками примерно по batch_size объявлений, так что память не
+        зависит от числа объявлений
+        """
+        batch, size = [], 0
+        bucket, key = [], None
+        rows = AdBandHash.objects.order_by("band", "hash", "ad_id").values_list("band", "hash", "ad_id")
+        for band, value, ad_id in rows.iterator(chunk_size=batch_size):
+            if (band, value) != key:
+                if 1 < len(bucket) <= max_bucket:
+                    batch.append((key[0], bucket))
+                    size += len(bucket)
+                elif len(bucket) > max_bucket:
+                    self.oversized.add(key)
+                if size >= batch_size:
+                    yield batch
+                    batch, size = [], 0
+                bucket, key = [], (band, value)
+            bucket.append(ad_id)
+        if 1 < len(bucket) <= max_bucket:
+            batch.append((key[0], bucket))
+        elif len(bucket) > max_bucket:
+            self.oversized.add(key)
+        if batch:
+            yield batch
+
+    def met_in_earlier_band(self, band, first, second):
+        """
+        Пара попадает в одну корзину в каждой полосе, где совпали её строки
+        сигнатуры. Проверяем пару только в первой такой полосе, если та корзина
+        не была пропущена как слишком большая -- так без общего множества пар
+        каждая пара проверяется один раз
+        """
+        rows = ROWS_PER_BAND
+        equal = (first[:band * rows].reshape(band, rows) == second[:band * rows].reshape(band, rows)).all(axis=1)
+        return any((int(j), band_hash(first, j)) not in self.oversized for j in np.flatnonzero(equal))
@@ -0,0 +1,35 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ads import rankings, signals
+from ads.datasets import DatasetSync, DATASETS
+
+
+class Command(BaseCommand):
+    help = "Загружает datasets/*.csv в БД; с --sync обновляет только изменившиеся строки"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", default=os.path.join(settings.BASE_DIR, "datasets"))
+        parser.add_argument("--sync", action="store_true",
+                            help="не очищать таблицы, сравнить строки по контрольным суммам")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--only", nargs="+", choices=[dataset.name for dataset in DATASETS])
+
+    def handle(self, *args, **options):
+        sync = DatasetSync(options["dir"], options["batch_size"], options["only"])
+
+        with signals.muted():
+            if not options["sync"]:
+                sync.truncate()
+            stats = sync.run()
+
+        if any(counter["inserted"] or counter["updated"] or counter["deleted"] for counter in stats.values()):
+            rankings.rebuild()
+
+        for name, counter in stats.items():
+            self.stdout.write(
+                f"{name}: inserted {counter['inserted']}, updated {counter['updated']}, "
+                f"deleted {counter['deleted']}, unchanged {counter['unchanged']}"
+            )
@@ -0,0 +1,53 @@
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import urlopen
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Простой генератор нагрузки: N параллельных потоков бьют в URL, печатается сводка по статусам и задержкам"
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="например http://127.0.0.1:8000/ad/?page=1")
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--timeout", type=float, default=10)
+
+    def handle(self, *args, **options):
+        url, timeout = options["url"], options["timeout"]
+
+        def fetch(_):
+            started = time.perf_counter()
+            retry_after = None
+            try:
+                with urlopen(url, timeout=timeout) as response:
+                    response.read()
+                    status = response.status
+            except HTTPError as e:
+                status = e.code
+                retry_after = e.headers.get("Retry-After")
+            except (URLError, OSError):
+                status = "error"
+            return status, time.perf_counter() - started, retry_after
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options["concurrency"]) as executor:
+            results = list(executor.map(fetch, range(options["requests"])))
+        elapsed = time.perf_counter() - started
+
+        statuses = Counter(status for status, _, _ in results)
+        self.stdout.write(f"{len(results)} requests in {elapsed:.2f}s ({len(results) / elapsed:.0f} rps)")
+        for status, count in sorted(statuses.items(), key=str):
+            latencies = sorted(latency for s, latency, _ in results if s == status)
+            quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+            self.stdout.write(
+                f"  {status}: {count}, p50 {quantiles[49] * 1000:.1f} ms, "
+                f"p95 {quantiles[94] * 1000:.1f} ms, p99 {quantiles[98] * 1000:.1f} ms"
+            )
+        shed = [retry_after for status, _, retry_after in results if status == 503]
+        if shed:
+            self.stdout.write(f"  503 with Retry-After: {sum(1 for value in shed if value)} of {len(shed)}")
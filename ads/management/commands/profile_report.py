@@ -0,0 +1,70 @@
+import glob
+import os
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Склеивает collapsed-стеки ProfilingMiddleware по вьюхам и печатает сводку"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", default=settings.PROFILING_DIR)
+        parser.add_argument("--view", help="только вьюхи, в имени которых есть подстрока")
+        parser.add_argument("--top", type=int, default=10)
+        parser.add_argument("--out", help="каталог для склеенных <view>.collapsed (для flamegraph.pl)")
+        parser.add_argument("--clear", action="store_true", help="удалить исходные файлы после склейки")
+
+    def handle(self, *args, **options):
+        paths = glob.glob(os.path.join(options["dir"], "*.collapsed"))
+        views = defaultdict(Counter)
+        merged = []
+        for path in paths:
+            # <view>.<pid>.collapsed
+            name = os.path.basename(path).rsplit(".", 2)[0]
+            if options["view"] and options["view"] not in name:
+                continue
+            merged.append(path)
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    stack, _, count = line.rstrip("\n").rpartition(" ")
+                    if stack:
+                        views[name][stack] += int(count)
+
+        if not views:
+            self.stdout.write("Нет данных профилирования")
+            return
+
+        for name, stacks in sorted(views.items(), key=lambda item: -sum(item[1].values())):
+            self.print_summary(name, stacks, options["top"])
+            if options["out"]:
+                self.write_merged(options["out"], name, stacks)
+
+        if options["clear"]:
+            for path in merged:
+                os.remove(path)
+
+    def print_summary(self, name, stacks, top):
+        total = sum(stacks.values())
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{name}: {total} samples"))
+        self.stdout.write("  self:")
+        for frame, count in own.most_common(top):
+            self.stdout.write(f"    {count / total:6.1%}  {frame}")
+        self.stdout.write("  total:")
+        for frame, count in inclusive.most_common(top):
+            self.stdout.write(f"    {count / total:6.1%}  {frame}")
+
+    def write_merged(self, out_dir, name, stacks):
+        os.makedirs(out_dir, exist_ok=True)
+        with open(os.path.join(out_dir, f"{name}.collapsed"), "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from ads import rankings
+from ads.models import AdRanking
+
+
+class Command(BaseCommand):
+    help = "Полностью пересчитывает таблицу AdRanking"
+
+    def handle(self, *args, **options):
+        rankings.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано строк: {AdRanking.objects.count()}"))
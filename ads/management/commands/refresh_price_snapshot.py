@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ads import analytics
+
+
+class Command(BaseCommand):
+    help = "Обновляет колоночный снимок цен для /ad/stats/ (инкрементально по updated_at)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="построить снимок с нуля")
+        parser.add_argument("--dir", default=settings.ANALYTICS_DIR)
+
+    def handle(self, *args, **options):
+        meta = analytics.refresh(options["dir"], full=options["full"])
+        snapshot = analytics.Snapshot.load(options["dir"], meta)
+        self.stdout.write(self.style.SUCCESS(
+            f"Снимок {meta['generation']}: объявлений {len(snapshot['ad_id'])}, "
+            f"пар с категориями {len(snapshot['pair_ad_id'])}"
+        ))
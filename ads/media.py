@@ -0,0 +1,186 @@
+import hashlib
+import mimetypes
+import os
+import re
+from functools import lru_cache
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+HASHED_NAME_RE = re.compile(r"^[0-9a-f]{20}$")
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def hash_upload(uploaded_file, field_file):
+    """
+    Сохраняет загруженный файл под именем-хэшем содержимого: такое имя никогда
+    не указывает на другие байты, и картинку можно кэшировать навсегда. Те же
+    байты уже лежат в хранилище -- возвращаем имя существующего файла, иначе
+    storage.save() добавил бы к имени случайный суффикс
+    """
+    sha = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        sha.update(chunk)
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    name = field_file.field.generate_filename(field_file.instance, f"{sha.hexdigest()[:20]}{extension}")
+    if field_file.storage.exists(name):
+        return name
+    return field_file.storage.save(name, uploaded_file, max_length=field_file.field.max_length)
+
+
+def is_hashed(path):
+    return bool(HASHED_NAME_RE.match(os.path.splitext(os.path.basename(path))[0]))
+
+
+@lru_cache(maxsize=4096)
+def file_etag(path, mtime_ns, size):
+    """
+    Сильный ETag по содержимому. Для имён-хэшей берём хэш из имени, остальные
+    файлы хэшируем один раз на (mtime, size)
+    """
+    if is_hashed(path):
+        return f'"{os.path.splitext(os.path.basename(path))[0]}"'
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return f'"{sha.hexdigest()[:32]}"'
+
+
+class RangeUnsatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Разбирает одиночный диапазон Range: bytes=a-b | a- | -n и возвращает
+    (start, length). Несколько диапазонов не поддерживаем -- отдаём файл целиком
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        length = min(int(last), size)
+        if length == 0:
+            raise RangeUnsatisfiable()
+        return size - length, length
+
+    start = int(first)
+    if start >= size:
+        raise RangeUnsatisfiable()
+    end = min(int(last), size - 1) if last else size - 1
+    if end < start:
+        return None
+    return start, end - start + 1
+
+
+class RangeFile:
+    """
+    Файл, ограниченный диапазоном. fileno() и позиция у открытого файла
+    настоящие, так что wsgi.file_wrapper (gunicorn) отдаст диапазон через
+    sendfile, а read() не даст выйти за его границу
+    """
+
+    def __init__(self, f, start, length):
+        self.file = f
+        self.remaining = length
+        f.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+@require_safe
+def serve(request, path):
+    """
+    Раздача MEDIA_ROOT в продакшене: X-Accel-Redirect/X-Sendfile, если задан
+    MEDIA_SENDFILE_BACKEND, иначе FileResponse с поддержкой Range и ETag
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404()
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404()
+    if not os.path.isfile(full_path):
+        raise Http404()
+
+    size = stat.st_size
+    etag = file_etag(full_path, stat.st_mtime_ns, size)
+    content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(stat.st_mtime),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": (
+            "public, max-age=31536000, immutable" if is_hashed(full_path)
+            else f"public, max-age={settings.MEDIA_CACHE_MAX_AGE}"
+        ),
+    }
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == "*"):
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    backend = settings.MEDIA_SENDFILE_BACKEND
+    if backend:
+        # файл отдаёт фронтовой сервер, он же обрабатывает Range
+        response = HttpResponse(content_type=content_type)
+        if backend == "nginx":
+            response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_PREFIX + quote(path)
+        else:
+            response["X-Sendfile"] = full_path
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    byte_range = None
+    range_header = request.headers.get("Range")
+    if range_header and request.headers.get("If-Range", etag) == etag:
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeUnsatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, "rb"), content_type=content_type)
+    else:
+        start, length = byte_range
+        response = FileResponse(RangeFile(open(full_path, "rb"), start, length),
+                                status=206, content_type=content_type)
+        response["Content-Length"] = length
+        response["Content-Range"] = f"bytes {start}-{start + length - 1}/{size}"
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+# файлы не ходят в БД, statement_timeout и лимиты LoadSheddingMiddleware ни к чему
+serve.endpoint_class = None
@@ -0,0 +1,85 @@
+# Generated by Django 4.0.10 on 2026-10-19 12:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_name', models.CharField(max_length=20)),
+                ('last_name', models.CharField(max_length=20, null=True)),
+                ('username', models.SlugField(max_length=30)),
+                ('password', models.SlugField(max_length=30)),
+                ('role', models.CharField(choices=[('member', 'Участник'), ('moderator', 'Модератор'), ('admin', 'Админ')], default='member', max_length=15)),
+                ('age', models.PositiveIntegerField()),
+                ('location_name', models.CharField(max_length=1000, null=True)),
+            ],
+            options={
+                'verbose_name': 'Пользователь',
+                'verbose_name_plural': 'Пользователи',
+            },
+        ),
+        migrations.CreateModel(
+            name='Location',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, null=True)),
+                ('lat', models.FloatField(max_length=50, null=True)),
+                ('lng', models.FloatField(max_length=50, null=True)),
+            ],
+            options={
+                'verbose_name': 'Адрес',
+                'verbose_name_plural': 'Адреса',
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='ad',
+            options={'verbose_name': 'Объявление', 'verbose_name_plural': 'Объявления'},
+        ),
+        migrations.AlterModelOptions(
+            name='category',
+            options={'verbose_name': 'Категория', 'verbose_name_plural': 'Категории'},
+        ),
+        migrations.RemoveField(
+            model_name='ad',
+            name='address',
+        ),
+        migrations.RemoveField(
+            model_name='ad',
+            name='author',
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='categories',
+            field=models.ManyToManyField(to='ads.category'),
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='location_name',
+            field=models.CharField(max_length=1000, null=True),
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='logo',
+            field=models.ImageField(null=True, upload_to='logos/'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='author_id',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='ads.aduser'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.0.10 on 2026-10-19 12:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0002_aduser_location_alter_ad_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdRanking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('price', 'Самые дешёвые'), ('recent', 'Самые новые')], max_length=10)),
+                ('position', models.PositiveSmallIntegerField()),
+                ('ad_name', models.CharField(max_length=20)),
+                ('ad_price', models.PositiveIntegerField()),
+                ('ad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ads.ad')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ads.category')),
+            ],
+            options={
+                'verbose_name': 'Место в топе',
+                'verbose_name_plural': 'Топ объявлений по категориям',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='adranking',
+            constraint=models.UniqueConstraint(fields=('kind', 'category', 'position'), name='unique_ad_ranking_position'),
+        ),
+    ]
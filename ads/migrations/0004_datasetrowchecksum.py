@@ -0,0 +1,30 @@
+# Generated by Django 4.0.10 on 2026-10-19 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0003_adranking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetRowChecksum',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset', models.CharField(max_length=20)),
+                ('row_id', models.BigIntegerField()),
+                ('checksum', models.CharField(max_length=32)),
+            ],
+            options={
+                'verbose_name': 'Контрольная сумма строки датасета',
+                'verbose_name_plural': 'Контрольные суммы строк датасетов',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='datasetrowchecksum',
+            constraint=models.UniqueConstraint(fields=('dataset', 'row_id'), name='unique_dataset_row'),
+        ),
+    ]
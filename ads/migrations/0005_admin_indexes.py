@@ -0,0 +1,43 @@
+# Generated by Django 4.0.10 on 2026-10-19 12:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0004_datasetrowchecksum'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ad',
+            name='is_published',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AlterField(
+            model_name='ad',
+            name='name',
+            field=models.CharField(db_index=True, max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='aduser',
+            name='role',
+            field=models.CharField(choices=[('member', 'Участник'), ('moderator', 'Модератор'), ('admin', 'Админ')], db_index=True, default='member', max_length=15),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='is_active',
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(db_index=True, max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='location',
+            name='name',
+            field=models.CharField(db_index=True, max_length=200, null=True),
+        ),
+    ]
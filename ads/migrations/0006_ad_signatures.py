@@ -0,0 +1,42 @@
+# Generated by Django 4.0.10 on 2026-10-19 12:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0005_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdSignature',
+            fields=[
+                ('ad', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='ads.ad')),
+                ('minhash', models.BinaryField()),
+            ],
+            options={
+                'verbose_name': 'Сигнатура объявления',
+                'verbose_name_plural': 'Сигнатуры объявлений',
+            },
+        ),
+        migrations.CreateModel(
+            name='AdBandHash',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('hash', models.BigIntegerField()),
+                ('ad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ads.ad')),
+            ],
+            options={
+                'verbose_name': 'Хэш полосы LSH',
+                'verbose_name_plural': 'Хэши полос LSH',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='adbandhash',
+            index=models.Index(fields=['band', 'hash'], name='ads_bandhash_band_hash_idx'),
+        ),
+    ]
@@ -1,9 +1,10 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 
 
 class Category(models.Model):
-    name = models.CharField(max_length=20)
-    is_active = models.BooleanField(default=True)
+    name = models.CharField(max_length=20, db_index=True)
+    is_active = models.BooleanField(default=True, db_index=True)
 
     class Meta:
         verbose_name = "Категория"
@@ -14,7 +15,7 @@ class Category(models.Model):
 
 
 class Location(models.Model):
-    name = models.CharField(max_length=200, null=True)
+    name = models.CharField(max_length=200, null=True, db_index=True)
     lat = models.FloatField(max_length=50, null=True)
     lng = models.FloatField(max_length=50, null=True)
 
@@ -37,7 +38,7 @@ class AdUser(models.Model):
     last_name = models.CharField(max_length=20, null=True)
     username = models.SlugField(max_length=30)
     password = models.SlugField(max_length=30)
-    role = models.CharField(max_length=15, choices=ROLES, default="member")
+    role = models.CharField(max_length=15, choices=ROLES, default="member", db_index=True)
     age = models.PositiveIntegerField()
     location_name = models.CharField(max_length=1000, null=True)
     # user may have several ads?
@@ -52,14 +53,16 @@ class AdUser(models.Model):
 
 
 class Ad(models.Model):
-    name = models.CharField(max_length=20)
+    name = models.CharField(max_length=20, db_index=True)
     price = models.PositiveIntegerField()
     description = models.TextField(max_length=1000, null=True)
     logo = models.ImageField(upload_to='logos/', null=True)
-    is_published = models.BooleanField(default=False)
+    is_published = models.BooleanField(default=False, db_index=True)
     author_id = models.ForeignKey(AdUser, on_delete=models.CASCADE, null=True)
     location_name = models.CharField(max_length=1000, null=True)
     categories = models.ManyToManyField(Category)
+    # для инкрементального обновления снимка цен, см. ads/analytics.py
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     # category_id in table Ads
     # no location === annotate???
 
@@ -70,3 +73,106 @@ class Ad(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def effective_location_name(self):
+        """
+        Адрес объявления, а если он не указан -- адрес автора
+        """
+        if self.location_name is not None:
+            return self.location_name
+        return self.author_id.location_name if self.author_id_id else None
+
+
+def ad_location_name():
+    """
+    То же, что Ad.effective_location_name, для выборок: у объявлений из
+    датасета свой адрес не заполнен, для них берём адрес автора
+    """
+    return Coalesce("location_name", "author_id__location_name")
+
+
+
+class AdRanking(models.Model):
+    """
+    Материализованный топ опубликованных объявлений в категории: самые дешёвые
+    и самые новые. Пересчитывается в ads/rankings.py при изменении объявлений
+    """
+    PRICE = "price"
+    RECENT = "recent"
+    KINDS = [
+        (PRICE, "Самые дешёвые"),
+        (RECENT, "Самые новые")
+    ]
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    position = models.PositiveSmallIntegerField()
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE)
+    # копия полей объявления, чтобы топ читался без join с ads_ad
+    ad_name = models.CharField(max_length=20)
+    ad_price = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = "Место в топе"
+        verbose_name_plural = "Топ объявлений по категориям"
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "category", "position"], name="unique_ad_ranking_position")
+        ]
+
+    def __str__(self):
+        return f"{self.category_id}/{self.kind}/{self.position}"
+
+
+class DatasetRowChecksum(models.Model):
+    """
+    Контрольная сумма строки из datasets/*.csv на момент последней загрузки,
+    по ней load_datasets --sync пропускает неизменившиеся строки
+    """
+    dataset = models.CharField(max_length=20)
+    row_id = models.BigIntegerField()
+    checksum = models.CharField(max_length=32)
+
+    class Meta:
+        verbose_name = "Контрольная сумма строки датасета"
+        verbose_name_plural = "Контрольные суммы строк датасетов"
+        constraints = [
+            models.UniqueConstraint(fields=["dataset", "row_id"], name="unique_dataset_row")
+        ]
+
+    def __str__(self):
+        return f"{self.dataset}/{self.row_id}"
+
+
+class AdSignature(models.Model):
+    """
+    MinHash-сигнатура текста объявления (name + description), см. ads/duplicates.py
+    """
+    ad = models.OneToOneField(Ad, on_delete=models.CASCADE, primary_key=True)
+    minhash = models.BinaryField()
+
+    class Meta:
+        verbose_name = "Сигнатура объявления"
+        verbose_name_plural = "Сигнатуры объявлений"
+
+    def __str__(self):
+        return str(self.ad_id)
+
+
+class AdBandHash(models.Model):
+    """
+    Хэш одной полосы (band) LSH: объявления с совпадающим хэшем хотя бы в одной
+    полосе -- кандидаты в дубликаты
+    """
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE)
+    band = models.PositiveSmallIntegerField()
+    hash = models.BigIntegerField()
+
+    class Meta:
+        verbose_name = "Хэш полосы LSH"
+        verbose_name_plural = "Хэши полос LSH"
+        indexes = [
+            models.Index(fields=["band", "hash"], name="ads_bandhash_band_hash_idx")
+        ]
+
+    def __str__(self):
+        return f"{self.ad_id}/{self.band}"
@@ -0,0 +1,108 @@
+import hmac
+import os
+import random
+import sys
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+
+class StackSampler(threading.Thread):
+    """
+    Семплирующий профайлер: раз в interval секунд снимает стек потока,
+    обрабатывающего запрос, и считает одинаковые стеки
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None or self._stop_event.is_set():
+                continue
+            self.stacks[collapse_frame(frame)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+def collapse_frame(frame):
+    """
+    Стек в формате collapsed stacks (brendangregg/FlameGraph):
+    фреймы от корня к вершине через ";"
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def view_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unresolved"
+    view = getattr(match.func, "view_class", match.func)
+    return f"{view.__module__}.{view.__qualname__}"
+
+
+_write_lock = threading.Lock()
+
+
+def dump_stacks(name, stacks):
+    """
+    Дописывает стеки в файл <PROFILING_DIR>/<view>.<pid>.collapsed,
+    у каждого процесса свой файл, склеивает их команда profile_report
+    """
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    path = os.path.join(settings.PROFILING_DIR, f"{name}.{os.getpid()}.collapsed")
+    with _write_lock, open(path, "a", encoding="utf-8") as f:
+        for stack, count in stacks.items():
+            f.write(f"{stack} {count}\n")
+
+
+class ProfilingMiddleware:
+    """
+    Профилирует долю запросов PROFILING_SAMPLE_RATE, а также запросы с заголовком
+    X-Profile, равным PROFILING_TOKEN. При PROFILING_ENABLED = False middleware
+    отключается целиком и не добавляет накладных расходов
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        self.token = settings.PROFILING_TOKEN
+        self.interval = settings.PROFILING_INTERVAL
+
+    def should_profile(self, request):
+        header = request.headers.get("X-Profile")
+        if header and self.token and hmac.compare_digest(header.encode(), self.token.encode()):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            stacks = sampler.stop()
+            if stacks:
+                dump_stacks(view_name(request), stacks)
+
+        return response
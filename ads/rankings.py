@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.db import transaction
+
+from ads.models import Ad, AdRanking, Category
+
+ORDERINGS = {
+    AdRanking.PRICE: ("price", "id"),
+    # отдельного поля с датой создания нет, id растёт монотонно
+    AdRanking.RECENT: ("-id",),
+}
+
+
+def rank_category(category_id):
+    """
+    Пересчитывает топ одной категории: по запросу на каждый вид топа (не
+    больше RANKING_TOP_N строк), затем замена строк категории. Пересчёты одной
+    категории идут по очереди под блокировкой её строки, иначе параллельные
+    вставки нарушат unique_ad_ranking_position
+    """
+    with transaction.atomic():
+        locked = Category.objects.select_for_update().filter(pk=category_id).values_list("id", flat=True)
+        if not list(locked):
+            return
+
+        rows = []
+        for kind, ordering in ORDERINGS.items():
+            ads = Ad.objects.filter(categories=category_id, is_published=True).order_by(*ordering)
+            for position, (ad_id, name, price) in enumerate(
+                    ads.values_list("id", "name", "price")[:settings.RANKING_TOP_N]):
+                rows.append(AdRanking(
+                    kind=kind,
+                    category_id=category_id,
+                    position=position,
+                    ad_id=ad_id,
+                    ad_name=name,
+                    ad_price=price
+                ))
+
+        AdRanking.objects.filter(category_id=category_id).delete()
+        AdRanking.objects.bulk_create(rows)
+
+
+def rank_categories(category_ids):
+    # блокируем категории всегда по возрастанию id, чтобы не ловить дедлоки
+    existing = Category.objects.filter(pk__in=set(category_ids)).order_by("id").values_list("id", flat=True)
+    for category_id in existing:
+        rank_category(category_id)
+
+
+def rebuild():
+    # строки удалённых категорий удаляются каскадом, так что достаточно
+    # пересчитать каждую категорию под её блокировкой
+    with transaction.atomic():
+        for category_id in Category.objects.order_by("id").values_list("id", flat=True):
+            rank_category(category_id)
@@ -0,0 +1,167 @@
+from contextlib import contextmanager
+
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from ads import rankings, suggest
+from ads.models import Category, Location, AdUser, Ad, ad_location_name
+
+
+def touch_ads(ad_ids):
+    """
+    Сдвигает updated_at, чтобы объявления попали в инкрементальное обновление
+    снимка цен (ads/analytics.py): смена категорий -- тоже их изменение
+    """
+    if ad_ids:
+        Ad.objects.filter(pk__in=ad_ids).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, **kwargs):
+    if not suggest.category_index.is_built:
+        return
+    if instance.is_active:
+        suggest.category_index.put(instance.pk, instance.name)
+        suggest.refresh_category_weights([instance.pk])
+    else:
+        suggest.category_index.remove(instance.pk)
+
+
+@receiver(pre_delete, sender=Category)
+def category_pre_delete(sender, instance, **kwargs):
+    # связи с объявлениями удалятся без m2m_changed
+    instance._ad_ids = list(Ad.objects.filter(categories=instance).values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    suggest.category_index.remove(instance.pk)
+    touch_ads(getattr(instance, "_ad_ids", []))
+
+
+@receiver(post_save, sender=Location)
+def location_saved(sender, instance, **kwargs):
+    if not suggest.location_index.is_built:
+        return
+    suggest.location_index.put(instance.pk, instance.name)
+    suggest.refresh_location_weights([instance.name])
+
+
+@receiver(post_delete, sender=Location)
+def location_deleted(sender, instance, **kwargs):
+    suggest.location_index.remove(instance.pk)
+
+
+@receiver(pre_save, sender=AdUser)
+def ad_user_pre_save(sender, instance, **kwargs):
+    # объявления без своего адреса считаются по адресу автора
+    instance._old_location_name = None
+    if instance.pk:
+        instance._old_location_name = AdUser.objects.filter(pk=instance.pk).values_list(
+            "location_name", flat=True
+        ).first()
+
+
+@receiver(post_save, sender=AdUser)
+def ad_user_saved(sender, instance, created, **kwargs):
+    old_location_name = getattr(instance, "_old_location_name", None)
+    if not created and old_location_name != instance.location_name:
+        Ad.objects.filter(author_id=instance, location_name=None).update(updated_at=timezone.now())
+        suggest.refresh_location_weights([instance.location_name, old_location_name])
+
+
+@receiver(pre_save, sender=Ad)
+def ad_pre_save(sender, instance, **kwargs):
+    # запоминаем старый адрес, чтобы пересчитать и его
+    instance._old_location_name = None
+    if instance.pk and suggest.location_index.is_built:
+        instance._old_location_name = Ad.objects.filter(pk=instance.pk).values_list(
+            ad_location_name(), flat=True
+        ).first()
+
+
+@receiver(post_save, sender=Ad)
+def ad_saved(sender, instance, created, **kwargs):
+    # у нового объявления ещё нет категорий, их учтёт ad_categories_changed
+    if not created:
+        category_ids = list(instance.categories.values_list("id", flat=True))
+        rankings.rank_categories(category_ids)
+        suggest.refresh_category_weights(category_ids)
+    if suggest.location_index.is_built:
+        suggest.refresh_location_weights([
+            instance.effective_location_name, getattr(instance, "_old_location_name", None)
+        ])
+
+
+@receiver(pre_delete, sender=Ad)
+def ad_pre_delete(sender, instance, **kwargs):
+    instance._old_category_ids = list(instance.categories.values_list("id", flat=True))
+    instance._old_location_name = None
+    if suggest.location_index.is_built:
+        instance._old_location_name = instance.effective_location_name
+
+
+@receiver(post_delete, sender=Ad)
+def ad_deleted(sender, instance, **kwargs):
+    category_ids = getattr(instance, "_old_category_ids", [])
+    rankings.rank_categories(category_ids)
+    suggest.refresh_category_weights(category_ids)
+    suggest.refresh_location_weights([getattr(instance, "_old_location_name", None)])
+
+
+def ad_category_ids_changed(category_ids):
+    rankings.rank_categories(category_ids)
+    suggest.refresh_category_weights(category_ids)
+
+
+@receiver(m2m_changed, sender=Ad.categories.through)
+def ad_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ("post_add", "post_remove"):
+        touch_ads(pk_set if reverse else [instance.pk])
+    elif action == "pre_clear" and reverse:
+        # при clear() pk_set пустой, объявления категории запоминаем заранее
+        instance._cleared_ad_ids = list(instance.ad_set.values_list("id", flat=True))
+    elif action == "post_clear":
+        touch_ads(getattr(instance, "_cleared_ad_ids", []) if reverse else [instance.pk])
+    if reverse:
+        # category.ad_set.add(...) -- меняется только эта категория
+        if action in ("post_add", "post_remove", "post_clear"):
+            ad_category_ids_changed([instance.pk])
+    elif action == "pre_clear":
+        instance._cleared_category_ids = list(instance.categories.values_list("id", flat=True))
+    elif action in ("post_add", "post_remove"):
+        ad_category_ids_changed(list(pk_set))
+    elif action == "post_clear":
+        ad_category_ids_changed(getattr(instance, "_cleared_category_ids", []))
+
+
+RECEIVERS = [
+    (post_save, category_saved, Category),
+    (pre_delete, category_pre_delete, Category),
+    (post_delete, category_deleted, Category),
+    (post_save, location_saved, Location),
+    (post_delete, location_deleted, Location),
+    (pre_save, ad_user_pre_save, AdUser),
+    (post_save, ad_user_saved, AdUser),
+    (pre_save, ad_pre_save, Ad),
+    (post_save, ad_saved, Ad),
+    (pre_delete, ad_pre_delete, Ad),
+    (post_delete, ad_deleted, Ad),
+    (m2m_changed, ad_categories_changed, Ad.categories.through),
+]
+
+
+@contextmanager
+def muted():
+    """
+    Отключает обработчики на время массовых операций, после которых
+    производные данные пересчитываются целиком
+    """
+    for signal, handler, sender in RECEIVERS:
+        signal.disconnect(handler, sender=sender)
+    try:
+        yield
+    finally:
+        for signal, handler, sender in RECEIVERS:
+            signal.connect(handler, sender=sender)
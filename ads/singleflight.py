@@ -0,0 +1,136 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from ads.limits import run_limited
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Схлопывание одинаковых одновременных вычислений: первый запрос по ключу
+    считает результат, остальные ждут его и получают тот же результат
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats_lock = threading.Lock()
+        self.stats = {"leaders": 0, "coalesced": 0, "cross_process": 0}
+
+    def incr(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self.incr("coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        self.incr("leaders")
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+
+flight = SingleFlight()
+
+
+def _cross_process(key, fn):
+    """
+    Межпроцессное схлопывание через кэш: лидер берёт блокировку cache.add и
+    кладёт результат в кэш, остальные процессы ждут этот результат. Результат
+    читается только во время ожидания лидера, кэшем ответов он не служит
+    """
+    digest = hashlib.md5(key.encode()).hexdigest()
+    lock_key = f"singleflight:lock:{digest}"
+    result_key = f"singleflight:result:{digest}"
+    timeout = settings.SINGLEFLIGHT_LOCK_TIMEOUT
+
+    if cache.add(lock_key, 1, timeout):
+        # результат прошлого лидера ждущим уже не подходит
+        cache.delete(result_key)
+        try:
+            result = fn()
+            if result[0] == 200:
+                cache.set(result_key, result, settings.SINGLEFLIGHT_RESULT_TTL)
+            return result
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(settings.SINGLEFLIGHT_POLL_INTERVAL)
+        result = cache.get(result_key)
+        if result is not None:
+            flight.incr("cross_process")
+            return result
+        if cache.get(lock_key) is None:
+            break
+
+    # лидер упал или ответил ошибкой -- считаем сами
+    return fn()
+
+
+def coalesce(view):
+    """
+    Декоратор GET-вьюхи: одинаковые (по полному пути) одновременные запросы
+    получают один и тот же ответ. Ответ собирается заново для каждого
+    запроса, middleware не делят между собой один объект HttpResponse.
+    Слот и statement_timeout LoadSheddingMiddleware берёт только лидер
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != "GET":
+            return view(request, *args, **kwargs)
+
+        def compute():
+            if hasattr(request, "endpoint_limit"):
+                name, timeout = request.endpoint_limit
+                response = run_limited(name, timeout, lambda: view(request, *args, **kwargs))
+            else:
+                response = view(request, *args, **kwargs)
+            return response.status_code, response["Content-Type"], response.content, response.get("Retry-After")
+
+        key = request.get_full_path()
+        if settings.SINGLEFLIGHT_CROSS_PROCESS:
+            status, content_type, content, retry_after = flight.do(key, lambda: _cross_process(key, compute))
+        else:
+            status, content_type, content, retry_after = flight.do(key, compute)
+
+        response = HttpResponse(content, status=status, content_type=content_type)
+        if retry_after is not None:
+            response["Retry-After"] = retry_after
+        return response
+
+    wrapper.coalesced = True
+    return wrapper
@@ -0,0 +1,161 @@
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from ads.models import Category, Location, Ad, ad_location_name
+
+WORD_RE = re.compile(r"\w+")
+
+
+def fold(text):
+    """
+    Нормализация для поиска без учёта регистра: casefold корректно работает
+    с кириллицей, "ё" приравниваем к "е"
+    """
+    return text.casefold().replace("ё", "е")
+
+
+class PrefixIndex:
+    """
+    Префиксный индекс в памяти процесса: отсортированный массив пар
+    (ключ, id), где ключи -- хвосты названия, начинающиеся с каждого слова,
+    чтобы "студ" находил "Москва, м. Студенческая"
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.built_at = None
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._keys = []
+        self._names = {}
+        self._weights = {}
+
+    @staticmethod
+    def tokens(name):
+        folded = fold(name or "")
+        return {folded[m.start():] for m in WORD_RE.finditer(folded)}
+
+    def build(self):
+        keys, names, weights = [], {}, {}
+        for pk, name, weight in self.loader():
+            names[pk] = name
+            weights[pk] = weight
+            keys.extend((token, pk) for token in self.tokens(name))
+        keys.sort()
+
+        with self._lock:
+            self._keys, self._names, self._weights = keys, names, weights
+            self.built_at = time.monotonic()
+
+    def is_stale(self):
+        ttl = settings.SUGGEST_INDEX_TTL
+        return self.built_at is None or bool(ttl and time.monotonic() - self.built_at > ttl)
+
+    def ensure_built(self):
+        """
+        Индекс перестраивает один поток. Пока устаревший индекс перестраивается,
+        остальные запросы отвечают по нему и в БД не ходят; ждут только самого
+        первого построения, когда отвечать ещё нечем
+        """
+        if not self.is_stale():
+            return
+        if not self._build_lock.acquire(blocking=not self.is_built):
+            return
+        try:
+            if self.is_stale():
+                self.build()
+        finally:
+            self._build_lock.release()
+
+    @property
+    def is_built(self):
+        return self.built_at is not None
+
+    def _remove_keys(self, pk):
+        for token in self.tokens(self._names.get(pk)):
+            i = bisect_left(self._keys, (token, pk))
+            if i < len(self._keys) and self._keys[i] == (token, pk):
+                del self._keys[i]
+
+    def put(self, pk, name, weight=None):
+        with self._lock:
+            self._remove_keys(pk)
+            self._names[pk] = name
+            if weight is not None or pk not in self._weights:
+                self._weights[pk] = weight or 0
+            for token in self.tokens(name):
+                insort(self._keys, (token, pk))
+
+    def remove(self, pk):
+        with self._lock:
+            self._remove_keys(pk)
+            self._names.pop(pk, None)
+            self._weights.pop(pk, None)
+
+    def set_weight(self, pk, weight):
+        with self._lock:
+            if pk in self._names:
+                self._weights[pk] = weight
+
+    def search(self, query, limit):
+        prefix = fold(query.strip())
+        if not prefix:
+            return []
+
+        with self._lock:
+            matched = set()
+            i = bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and self._keys[i][0].startswith(prefix):
+                matched.add(self._keys[i][1])
+                i += 1
+
+            top = heapq.nsmallest(
+                limit, matched,
+                key=lambda pk: (-self._weights[pk], fold(self._names[pk]), pk)
+            )
+            return [(pk, self._names[pk], self._weights[pk]) for pk in top]
+
+
+def load_categories():
+    return Category.objects.filter(is_active=True).annotate(
+        ads_count=Count("ad", filter=Q(ad__is_published=True))
+    ).values_list("id", "name", "ads_count")
+
+
+def count_ads_by_location(names=None):
+    ads = Ad.objects.filter(is_published=True).annotate(ad_location=ad_location_name())
+    if names is not None:
+        ads = ads.filter(ad_location__in=names)
+    return dict(ads.values_list("ad_location").annotate(Count("id")))
+
+
+def load_locations():
+    counts = count_ads_by_location()
+    for pk, name in Location.objects.values_list("id", "name"):
+        yield pk, name, counts.get(name, 0)
+
+
+category_index = PrefixIndex(load_categories)
+location_index = PrefixIndex(load_locations)
+
+
+def refresh_category_weights(pks):
+    if not category_index.is_built or not pks:
+        return
+    for pk, _, ads_count in load_categories().filter(pk__in=pks):
+        category_index.set_weight(pk, ads_count)
+
+
+def refresh_location_weights(names):
+    names = {name for name in names if name}
+    if not location_index.is_built or not names:
+        return
+    counts = count_ads_by_location(names)
+    for pk, name in Location.objects.filter(name__in=names).values_list("id", "name"):
+        location_index.set_weight(pk, counts.get(name, 0))
@@ -1,3 +1,994 @@
-from django.test import TestCase
+import csv
+import os
+import sys
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import MiddlewareNotUsed, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+import numpy as np
+
+from ads import analytics, media, rankings, signals
+from ads.datasets import DatasetSync
+from ads.duplicates import (
+    MERSENNE_PRIME, PERMUTATIONS, ROWS_PER_BAND, _hash64, shingles, signature, similar_ads, update_signature
+)
+from ads.limits import EndpointLimiter, LoadSheddingMiddleware
+from ads.models import Ad, AdRanking, AdUser, Category
+from ads.profiling import ProfilingMiddleware, collapse_frame
+from ads.singleflight import SingleFlight, _cross_process, coalesce, flight
+from ads.suggest import PrefixIndex, count_ads_by_location, fold
+from ads.views import paginate
+
+
+class AdAdminTestCase(TestCase):
+
+    def setUp(self):
+        admin_user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(admin_user)
+        self.category = Category.objects.create(name="Котики")
+
+    def create_ads(self, count):
+        for i in range(count):
+            author = AdUser.objects.create(first_name="Иван", username=f"user{i}", password="x", age=20)
+            ad = Ad.objects.create(name=f"ad{i}", price=i, author_id=author)
+            ad.categories.add(self.category)
+
+    def changelist_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/admin/ads/ad/")
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_query_count_does_not_grow_with_rows(self):
+        self.create_ads(2)
+        few = self.changelist_queries()
+
+        self.create_ads(30)
+        many = self.changelist_queries()
+
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, 10)
+
+    def test_change_form_does_not_render_all_authors(self):
+        self.create_ads(30)
+        ad = Ad.objects.first()
+
+        response = self.client.get(f"/admin/ads/ad/{ad.pk}/change/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "user29")
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    callers = 8
+
+    def run_concurrently(self, flight, fn):
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(flight.do("key", fn))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(self.callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results, errors
+
+    def blocking(self, flight, result=None, error=None):
+        # лидер не закончит, пока все остальные не встанут в ожидание
+        calls = []
+
+        def fn():
+            calls.append(1)
+            for _ in range(5000):
+                if flight.stats["coalesced"] == self.callers - 1:
+                    break
+                threading.Event().wait(0.001)
+            if error is not None:
+                raise error
+            return result
+
+        return fn, calls
+
+    def test_concurrent_callers_share_one_computation(self):
+        flight = SingleFlight()
+        result = object()
+        fn, calls = self.blocking(flight, result=result)
+
+        results, errors = self.run_concurrently(flight, fn)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), self.callers)
+        self.assertTrue(all(r is result for r in results))
+        self.assertEqual(flight.stats["leaders"], 1)
+
+    def test_error_is_shared_with_waiters(self):
+        flight = SingleFlight()
+        error = ValueError("boom")
+        fn, calls = self.blocking(flight, error=error)
+
+        results, errors = self.run_concurrently(flight, fn)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), self.callers)
+        self.assertTrue(all(e is error for e in errors))
+
+    def test_next_call_after_leader_computes_again(self):
+        flight = SingleFlight()
+        calls = []
+
+        flight.do("key", lambda: calls.append(1))
+        flight.do("key", lambda: calls.append(1))
+
+        self.assertEqual(len(calls), 2)
+
+    def test_cross_process_result_is_not_a_response_cache(self):
+        cache.clear()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            return 200, "application/json", b"{}"
+
+        _cross_process("/ad/1/", fn)
+        _cross_process("/ad/1/", fn)
+
+        self.assertEqual(len(calls), 2)
+
+
+class PrefixIndexTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.index = PrefixIndex(lambda: [
+            (1, "Москва, м. Студенческая", 5),
+            (2, "Ёлкино", 1),
+            (3, "Студёный переулок", 9),
+        ])
+        self.index.build()
+
+    def names(self, query, limit=10):
+        return [name for _, name, _ in self.index.search(query, limit)]
+
+    def test_fold_ignores_case_and_yo(self):
+        self.assertEqual(fold("ЁЛКА Ёж"), "елка еж")
+        self.assertEqual(fold("Straße"), "strasse")
+
+    def test_search_matches_any_word_prefix(self):
+        self.assertEqual(self.names("студ"), ["Студёный переулок", "Москва, м. Студенческая"])
+        self.assertEqual(self.names("СТУДЕН"), ["Студёный переулок", "Москва, м. Студенческая"])
+        self.assertEqual(self.names("елк"), ["Ёлкино"])
+        self.assertEqual(self.names("м. студ"), ["Москва, м. Студенческая"])
+        self.assertEqual(self.names("студ", limit=1), ["Студёный переулок"])
+        self.assertEqual(self.names("  "), [])
+
+    def test_put_and_remove(self):
+        self.index.put(4, "Ёжиково", 3)
+        self.assertEqual(self.names("еж"), ["Ёжиково"])
+
+        self.index.put(2, "Сосновка")
+        self.assertEqual(self.names("елк"), [])
+        self.assertEqual(self.index.search("сосн", 10), [(2, "Сосновка", 1)])
+
+        self.index.remove(3)
+        self.assertEqual(self.names("студ"), ["Москва, м. Студенческая"])
+
+        self.index.set_weight(3, 100)
+        self.assertEqual(self.names("студ"), ["Москва, м. Студенческая"])
+
+
+class PrefixIndexRebuildTestCase(SimpleTestCase):
+
+    def test_expired_index_is_rebuilt_by_one_thread(self):
+        loads = []
+        release = threading.Event()
+
+        def loader():
+            loads.append(1)
+            if len(loads) > 1:
+                release.wait(5)
+            return [(1, f"Москва {len(loads)}", 0)]
+
+        index = PrefixIndex(loader)
+        index.build()
+        index.built_at -= 3600
+
+        with self.settings(SUGGEST_INDEX_TTL=60):
+            rebuild = threading.Thread(target=index.ensure_built)
+            rebuild.start()
+            for _ in range(500):
+                if len(loads) == 2:
+                    break
+                threading.Event().wait(0.001)
+
+            # пока идёт перестроение, остальные отвечают по старому индексу
+            for _ in range(10):
+                index.ensure_built()
+            self.assertEqual(index.search("моск", 10), [(1, "Москва 1", 0)])
+
+            release.set()
+            rebuild.join(5)
+
+            self.assertEqual(len(loads), 2)
+            self.assertEqual(index.search("моск", 10), [(1, "Москва 2", 0)])
+            index.ensure_built()
+            self.assertEqual(len(loads), 2)
+
+
+class CountAdsByLocationTestCase(TestCase):
+
+    def test_ads_without_location_use_author_location(self):
+        author = AdUser.objects.create(first_name="Иван", username="ivan", password="x", age=20,
+                                       location_name="Москва")
+        Ad.objects.create(name="a", price=1, author_id=author, is_published=True)
+        Ad.objects.create(name="b", price=1, author_id=author, is_published=True, location_name="Казань")
+        Ad.objects.create(name="c", price=1, author_id=author, is_published=False)
+
+        self.assertEqual(count_ads_by_location(), {"Москва": 1, "Казань": 1})
+        self.assertEqual(count_ads_by_location(["Москва"]), {"Москва": 1})
+
+
+class DatasetSyncTestCase(TestCase):
+    ad_columns = ["Id", "name", "author_id", "price", "description", "is_published", "image", "category_id"]
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.write("category", ["id", "name"], [[1, "Котики"], [2, "Книги"]])
+        self.write("ad", self.ad_columns, [
+            [1, "Котёнок", "", 100, "", "TRUE", "", 1],
+            [2, "Словарь", "", 200, "", "FALSE", "", 2],
+            [3, "Щенок", "", 300, "", "TRUE", "", 1],
+        ])
+
+    def write(self, name, columns, rows):
+        with open(os.path.join(self.directory, f"{name}.csv"), "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+
+    def sync(self):
+        stats = DatasetSync(self.directory, names={"category", "ad"}).run()
+        # без нулевых счётчиков
+        return {name: dict(+counter) for name, counter in stats.items()}
+
+    def test_initial_load_inserts_rows(self):
+        stats = self.sync()
+
+        self.assertEqual(stats["category"], {"inserted": 2})
+        self.assertEqual(stats["ad"], {"inserted": 3})
+        self.assertEqual(list(Ad.objects.get(pk=3).categories.values_list("id", flat=True)), [1])
+
+    def test_rerun_is_all_unchanged(self):
+        self.sync()
+
+        stats = self.sync()
+
+        self.assertEqual(stats["category"], {"unchanged": 2})
+        self.assertEqual(stats["ad"], {"unchanged": 3})
+
+    def test_changed_row_is_updated_and_dropped_row_is_deleted(self):
+        self.sync()
+        updated_at = Ad.objects.get(pk=1).updated_at
+        self.write("ad", self.ad_columns, [
+            [1, "Котёнок", "", 150, "", "TRUE", "", 2],
+            [2, "Словарь", "", 200, "", "FALSE", "", 2],
+        ])
+
+        stats = self.sync()
+
+        self.assertEqual(stats["ad"], {"updated": 1, "unchanged": 1, "deleted": 1})
+        ad = Ad.objects.get(pk=1)
+        self.assertEqual(ad.price, 150)
+        self.assertGreater(ad.updated_at, updated_at)
+        self.assertEqual(list(ad.categories.values_list("id", flat=True)), [2])
+        self.assertFalse(Ad.objects.filter(pk=3).exists())
+
+
+class ParseRangeTestCase(SimpleTestCase):
+
+    def test_ranges(self):
+        self.assertEqual(media.parse_range("bytes=0-3", 10), (0, 4))
+        self.assertEqual(media.parse_range("bytes=5-", 10), (5, 5))
+        self.assertEqual(media.parse_range("bytes=-3", 10), (7, 3))
+        self.assertEqual(media.parse_range("bytes=-30", 10), (0, 10))
+        self.assertEqual(media.parse_range("bytes=8-100", 10), (8, 2))
+
+    def test_ignored_ranges(self):
+        self.assertIsNone(media.parse_range("bytes=-", 10))
+        self.assertIsNone(media.parse_range("bytes=5-2", 10))
+        self.assertIsNone(media.parse_range("bytes=0-1,3-4", 10))
+        self.assertIsNone(media.parse_range("items=0-1", 10))
+
+    def test_unsatisfiable_ranges(self):
+        with self.assertRaises(media.RangeUnsatisfiable):
+            media.parse_range("bytes=10-", 10)
+        with self.assertRaises(media.RangeUnsatisfiable):
+            media.parse_range("bytes=-0", 10)
+
+
+class MediaServeTestCase(SimpleTestCase):
+    content = b"0123456789"
+    name = "logos/0123456789abcdef0123.jpg"
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        os.makedirs(os.path.join(self.root, "logos"))
+        with open(os.path.join(self.root, self.name), "wb") as f:
+            f.write(self.content)
+        media.file_etag.cache_clear()
+        self.etag = '"0123456789abcdef0123"'
+
+    def serve(self, **headers):
+        with self.settings(MEDIA_ROOT=self.root):
+            response = media.serve(RequestFactory().get(f"/media/{self.name}", **headers), self.name)
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_full_file(self):
+        response = self.serve()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+        self.assertEqual(response["ETag"], self.etag)
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+
+    def test_not_modified(self):
+        response = self.serve(HTTP_IF_NONE_MATCH=self.etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], self.etag)
+
+    def test_range(self):
+        response = self.serve(HTTP_RANGE="bytes=2-5")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), b"2345")
+        self.assertEqual(response["Content-Range"], "bytes 2-5/10")
+        self.assertEqual(response["Content-Length"], "4")
+
+    def test_if_range(self):
+        response = self.serve(HTTP_RANGE="bytes=2-5", HTTP_IF_RANGE=self.etag)
+        self.assertEqual(response.status_code, 206)
+
+        # файл сменился -- отдаём целиком
+        response = self.serve(HTTP_RANGE="bytes=2-5", HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+
+    def test_range_not_satisfiable(self):
+        response = self.serve(HTTP_RANGE="bytes=10-")
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */10")
+
+    def test_sendfile_backends(self):
+        with self.settings(MEDIA_SENDFILE_BACKEND="nginx"):
+            response = self.serve(HTTP_RANGE="bytes=2-5")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{self.name}")
+        self.assertEqual(response.content, b"")
+
+        with self.settings(MEDIA_SENDFILE_BACKEND="apache"):
+            response = self.serve()
+        self.assertEqual(response["X-Sendfile"], os.path.join(self.root, self.name))
+        self.assertEqual(response["ETag"], self.etag)
+
+    def test_missing_file(self):
+        with self.settings(MEDIA_ROOT=self.root), self.assertRaises(media.Http404):
+            media.serve(RequestFactory().get("/media/../x"), "../x")
+
+
+class HashUploadTestCase(SimpleTestCase):
+
+    def test_same_bytes_reuse_stored_file(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        with override_settings(MEDIA_ROOT=tmp.name):
+            first = media.hash_upload(SimpleUploadedFile("a.JPG", b"image"), Ad().logo)
+            second = media.hash_upload(SimpleUploadedFile("b.jpg", b"image"), Ad().logo)
+
+        self.assertEqual(first, second)
+        self.assertTrue(media.is_hashed(first))
+        self.assertTrue(first.startswith("logos/") and first.endswith(".jpg"))
+        self.assertEqual(os.listdir(os.path.join(tmp.name, "logos")), [os.path.basename(first)])
+
+
+class MinHashTestCase(TestCase):
+    text = "Продаю котят сибирской породы, возраст 3 месяца, приучены к лотку"
+
+    def create_ad(self, name, description):
+        ad = Ad.objects.create(name=name, price=100, description=description)
+        update_signature(ad)
+        return ad
+
+    def test_shingles_ignore_case_yo_and_punctuation(self):
+        self.assertEqual(shingles("Ёлка!!  ЗЕЛЁНАЯ"), shingles("елка, зеленая"))
+        self.assertEqual(shingles("Кот"), {"кот"})
+        self.assertEqual(shingles(" ... "), set())
+        self.assertEqual(shingles("котики"), {"котик", "отики"})
+
+    def test_signature_matches_reference(self):
+        hashes = [_hash64(shingle.encode()) for shingle in shingles(self.text)]
+        expected = [
+            min((a * h + b) % MERSENNE_PRIME for h in hashes) & 0xFFFFFFFF
+            for a, b in PERMUTATIONS
+        ]
+
+        self.assertEqual(signature(self.text).tolist(), expected)
+        self.assertIsNone(signature(""))
+
+    def test_similar_ads(self):
+        ad = self.create_ad("Котята", self.text)
+        duplicate = self.create_ad("котята!", self.text.replace("3 месяца", "три месяца"))
+        self.create_ad("Велосипед", "Горный велосипед, 21 скорость, почти новый")
+
+        found = similar_ads(ad, threshold=0.5, limit=5)
+
+        self.assertEqual([similar for similar, _ in found], [duplicate])
+        self.assertGreater(found[0][1], 0.5)
+
+    def find_duplicates(self, **options):
+        stdout, stderr = StringIO(), StringIO()
+        call_command("find_duplicates", threshold=0.1, stdout=stdout, stderr=stderr, **options)
+        pairs = [tuple(int(ad_id) for ad_id in line.split("\t")[:2]) for line in stdout.getvalue().splitlines()]
+        return pairs, stderr.getvalue()
+
+    def test_find_duplicates_reports_each_pair_once(self):
+        first = self.create_ad("Котята", self.text)
+        second = self.create_ad("Котята", self.text)
+        near = self.create_ad("Котята", self.text + " торг")
+        self.create_ad("Велосипед", "Горный велосипед, 21 скорость, почти новый")
+
+        pairs, summary = self.find_duplicates()
+
+        self.assertEqual(sorted(pairs), [(first.pk, second.pk), (first.pk, near.pk), (second.pk, near.pk)])
+        self.assertIn("Кандидатов: 3", summary)
+
+    def test_find_duplicates_skips_oversized_buckets(self):
+        first = self.create_ad("Котята", self.text)
+        second = self.create_ad("Котята", self.text)
+        near = self.create_ad("Котята", self.text + " торг")
+        bands = (signature(self.text) == signature(self.text + " торг")).reshape(-1, ROWS_PER_BAND).all(axis=1)
+        # первые полосы у всех троих совпадают, такие корзины пропускаются
+        self.assertTrue(bands[0] and not bands.all())
+
+        pairs, _ = self.find_duplicates(max_bucket=2, batch_size=3)
+
+        self.assertEqual(pairs, [(first.pk, second.pk)])
+        self.assertNotIn(near.pk, [ad_id for pair in pairs for ad_id in pair])
+
+    def test_similar_ads_uses_stored_signature(self):
+        ad = self.create_ad("Котята", self.text)
+        duplicate = self.create_ad("Котята", self.text)
+        # сигнатура не пересчитывается из текста объявления
+        ad.description = "Горный велосипед, 21 скорость, почти новый"
+
+        found = similar_ads(ad, threshold=0.5, limit=5)
+
+        self.assertEqual(found, [(duplicate, 1.0)])
+
+
+class QueryCanceled(Exception):
+    pgcode = "57014"
+
+
+class LoadSheddingTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.limiter = EndpointLimiter(2)
+        patcher = mock.patch.dict("ads.limits.limiters", {"read": self.limiter})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.middleware = LoadSheddingMiddleware(lambda request: None)
+
+    def call(self, view, request=None):
+        request = request or RequestFactory().get("/ad/")
+        response = self.middleware.process_view(request, view, (), {})
+        return view(request) if response is None else response
+
+    def test_saturated_endpoint_returns_503(self):
+        self.assertTrue(self.limiter.acquire())
+        self.assertTrue(self.limiter.acquire())
+        try:
+            response = self.call(lambda request: JsonResponse({}))
+        finally:
+            self.limiter.release()
+            self.limiter.release()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(self.limiter.stats["rejected"], 1)
+
+    def test_slot_is_released_on_exception(self):
+        def view(request):
+            raise ValueError()
+
+        for _ in range(3):
+            with self.assertRaises(ValueError):
+                self.call(view)
+
+        self.assertEqual(self.limiter.stats["in_flight"], 0)
+        self.assertEqual(self.call(lambda request: JsonResponse({})).status_code, 200)
+
+    def test_query_canceled_returns_503(self):
+        def view(request):
+            raise OperationalError("canceling statement due to statement timeout") from QueryCanceled()
+
+        response = self.call(view)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.limiter.stats["timeouts"], 1)
+        self.assertEqual(self.limiter.stats["in_flight"], 0)
+
+    def test_other_operational_errors_are_not_hidden(self):
+        def view(request):
+            raise OperationalError("connection lost")
+
+        with self.assertRaises(OperationalError):
+            self.call(view)
+
+    def test_unlimited_endpoint(self):
+        def view(request):
+            return JsonResponse({"in_flight": self.limiter.stats["in_flight"]})
+        view.endpoint_class = None
+
+        response = self.call(view)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(response.content, {"in_flight": 0})
+
+    def test_coalesced_waiters_do_not_take_slots(self):
+        callers = 8
+        coalesced = flight.stats["coalesced"]
+        in_flight = []
+
+        @coalesce
+        def view(request):
+            in_flight.append(self.limiter.stats["in_flight"])
+            for _ in range(5000):
+                if flight.stats["coalesced"] - coalesced == callers - 1:
+                    break
+                threading.Event().wait(0.001)
+            return JsonResponse({})
+
+        statuses = []
+
+        def call():
+            statuses.append(self.call(view, RequestFactory().get("/ad/coalesced/")).status_code)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(statuses, [200] * callers)
+        self.assertEqual(in_flight, [1])
+        self.assertEqual(self.limiter.stats["rejected"], 0)
+
+    def test_coalesced_leader_shares_overload(self):
+        @coalesce
+        def view(request):
+            return JsonResponse({})
+
+        self.assertTrue(self.limiter.acquire())
+        self.assertTrue(self.limiter.acquire())
+        try:
+            response = self.call(view)
+        finally:
+            self.limiter.release()
+            self.limiter.release()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+
+
+class PaginateTestCase(TestCase):
+
+    def page(self, query):
+        return paginate(RequestFactory().get("/cat/", query), Category.objects.order_by("id"))
+
+    @override_settings(MAX_PAGE_SIZE=20, TOTAL_ON_PAGE=3)
+    def test_page_size_is_capped(self):
+        paginator, _ = self.page({"page_size": "100000"})
+        self.assertEqual(paginator.per_page, 20)
+
+        paginator, _ = self.page({"page_size": "7"})
+        self.assertEqual(paginator.per_page, 7)
+
+        paginator, _ = self.page({})
+        self.assertEqual(paginator.per_page, 3)
+
+    def test_invalid_page_size(self):
+        for value in ("abc", "0", "-1"):
+            with self.assertRaises(ValidationError) as e:
+                self.page({"page_size": value})
+            self.assertIn("page_size", e.exception.message_dict)
+
+    @override_settings(MAX_PAGE_NUMBER=10)
+    def test_page_number_is_capped(self):
+        with self.assertRaises(ValidationError) as e:
+            self.page({"page": "11"})
+        self.assertIn("page", e.exception.message_dict)
+
+        _, page_obj = self.page({"page": "10"})
+        self.assertEqual(page_obj.number, 1)
+
+    def test_list_view_returns_422(self):
+        response = self.client.get("/cat/", {"page_size": "abc"})
+
+        self.assertEqual(response.status_code, 422)
+
+
+class GroupedStatsTestCase(SimpleTestCase):
+
+    def test_matches_numpy(self):
+        rng = np.random.default_rng(1)
+        prices = rng.integers(0, 10000, 500).astype(np.uint32)
+        groups = rng.integers(0, 7, 500)
+        percentiles = [0, 10, 25, 50, 90, 99.5, 100]
+
+        keys, counts, values, means, histogram, edges = analytics.grouped_stats(prices, groups, percentiles, 12)
+
+        np.testing.assert_array_equal(edges, np.histogram_bin_edges(prices, bins=12))
+        self.assertEqual(keys.tolist(), sorted(set(groups.tolist())))
+        for i, key in enumerate(keys):
+            group = prices[groups == key]
+            self.assertEqual(counts[i], len(group))
+            np.testing.assert_allclose(values[i], np.percentile(group, percentiles))
+            self.assertAlmostEqual(means[i], group.mean())
+            np.testing.assert_array_equal(histogram[i], np.histogram(group, bins=edges)[0])
+
+    def test_single_value_group_and_empty_input(self):
+        keys, counts, values, _, histogram, _ = analytics.grouped_stats(
+            np.array([5, 7, 9], dtype=np.uint32), np.array([1, 2, 2]), [50], 2
+        )
+        self.assertEqual(values.tolist(), [[5.0], [8.0]])
+        self.assertEqual(histogram.tolist(), [[1, 0], [0, 2]])
+
+        keys, counts, *_ = analytics.grouped_stats(np.zeros(0, dtype=np.uint32), np.zeros(0), [50], 2)
+        self.assertEqual(len(keys), 0)
+
+
+@override_settings(ANALYTICS_REFRESH_OVERLAP=0)
+class PriceSnapshotTestCase(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.cats, self.dogs = Category.objects.create(name="Котики"), Category.objects.create(name="Собаки")
+        self.author = AdUser.objects.create(first_name="Иван", username="ivan", password="x", age=20,
+                                            location_name="Москва")
+        self.ads = []
+        for i in range(6):
+            ad = Ad.objects.create(name=f"ad{i}", price=100 * i, author_id=self.author, is_published=i % 2 == 0,
+                                   location_name="Казань" if i == 0 else None)
+            ad.categories.add(self.cats if i < 3 else self.dogs)
+            self.ads.append(ad)
+
+    def contents(self, meta, directory):
+        snapshot = analytics.Snapshot.load(directory, meta)
+        locations = [snapshot.locations[code] if code >= 0 else None for code in snapshot["location"].tolist()]
+        columns = {name: snapshot[name].tolist() for name in ("ad_id", "price", "is_published", "author_id")}
+        pairs = sorted(zip(snapshot["pair_ad_id"].tolist(), snapshot["pair_category_id"].tolist()))
+        return columns, locations, pairs
+
+    def assert_incremental_equals_full(self):
+        incremental = analytics.refresh(self.directory)
+        with tempfile.TemporaryDirectory() as full_directory:
+            full = analytics.refresh(full_directory, full=True)
+            self.assertEqual(self.contents(incremental, self.directory), self.contents(full, full_directory))
+
+    def test_incremental_refresh_matches_full_rebuild(self):
+        analytics.refresh(self.directory, full=True)
+
+        self.ads[1].price = 999
+        self.ads[1].save()
+        self.ads[2].delete()
+        self.ads[3].categories.add(self.cats)
+        Ad.objects.create(name="new", price=5, author_id=self.author, is_published=True).categories.add(self.dogs)
+        self.assert_incremental_equals_full()
+
+        self.author.location_name = "Самара"
+        self.author.save()
+        self.assert_incremental_equals_full()
+
+        self.cats.ad_set.clear()
+        self.assert_incremental_equals_full()
+
+        self.dogs.delete()
+        self.assert_incremental_equals_full()
+
+    def test_ad_created_between_reads_is_left_for_next_refresh(self):
+        fetch_pairs = analytics.fetch_pairs
+
+        def create_ad_then_fetch_pairs(*args, **kwargs):
+            # объявление с категорией появилось после чтения объявлений
+            ad = Ad.objects.create(name="late", price=7, author_id=self.author, is_published=True)
+            ad.categories.add(self.dogs)
+            self.late = ad
+            return fetch_pairs(*args, **kwargs)
+
+        with mock.patch("ads.analytics.fetch_pairs", side_effect=create_ad_then_fetch_pairs):
+            meta = analytics.refresh(self.directory, full=True)
+
+        snapshot = analytics.Snapshot.load(self.directory, meta)
+        self.assertNotIn(self.late.pk, snapshot["ad_id"].tolist())
+        self.assertTrue(np.isin(snapshot["pair_ad_id"], snapshot["ad_id"]).all())
+        keys, counts, *_ = analytics.price_stats(snapshot, "category", [50], 2)
+        self.assertEqual(counts.tolist(), [2, 1])
+
+        self.assert_incremental_equals_full()
+
+    def test_dataset_sync_changing_author_location(self):
+        with tempfile.TemporaryDirectory() as datasets:
+            def write(name, rows):
+                with open(os.path.join(datasets, f"{name}.csv"), "w", encoding="utf-8", newline="") as f:
+                    csv.writer(f).writerows(rows)
+
+            write("location", [["id", "name", "lat", "lng"], [1, "Москва", "", ""], [2, "Тверь", "", ""]])
+            write("user", [["id", "first_name", "last_name", "username", "password", "role", "age", "location_id"],
+                           [100, "Пётр", "", "petr", "x", "member", 30, 1]])
+            write("ad", [["Id", "name", "author_id", "price", "description", "is_published", "image", "category_id"],
+                         [100, "Лампа", 100, 500, "", "TRUE", "", ""]])
+            with signals.muted():
+                DatasetSync(datasets, names={"user", "ad"}).run()
+            analytics.refresh(self.directory, full=True)
+
+            write("user", [["id", "first_name", "last_name", "username", "password", "role", "age", "location_id"],
+                           [100, "Пётр", "", "petr", "x", "member", 30, 2]])
+            with signals.muted():
+                stats = DatasetSync(datasets, names={"user", "ad"}).run()
+
+        self.assertEqual(stats["user"]["updated"], 1)
+        self.assert_incremental_equals_full()
+
+    def test_stats_view_validates_parameters_separately(self):
+        response = self.client.get("/ad/stats/", {"q": "abc"})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(list(response.json()), ["q"])
+
+        response = self.client.get("/ad/stats/", {"bins": "1000"})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(list(response.json()), ["bins"])
+
+        response = self.client.get("/ad/stats/", {"q": "101", "bins": "x"})
+        self.assertEqual(sorted(response.json()), ["bins", "q"])
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0, PROFILING_TOKEN="секрет-token")
+class ProfilingTestCase(SimpleTestCase):
+
+    def middleware(self):
+        return ProfilingMiddleware(lambda request: JsonResponse({}))
+
+    def request(self, token=None):
+        headers = {"HTTP_X_PROFILE": token} if token is not None else {}
+        return RequestFactory().get("/", **headers)
+
+    def test_disabled_middleware_is_not_used(self):
+        with self.settings(PROFILING_ENABLED=False), self.assertRaises(MiddlewareNotUsed):
+            self.middleware()
+
+    def test_token(self):
+        middleware = self.middleware()
+
+        self.assertTrue(middleware.should_profile(self.request("секрет-token")))
+        self.assertFalse(middleware.should_profile(self.request("wrong")))
+        self.assertFalse(middleware.should_profile(self.request("секрет")))
+        self.assertFalse(middleware.should_profile(self.request()))
+
+    def test_token_not_configured(self):
+        with self.settings(PROFILING_TOKEN=""):
+            self.assertFalse(self.middleware().should_profile(self.request("")))
+
+    def test_sample_rate(self):
+        with self.settings(PROFILING_SAMPLE_RATE=0):
+            middleware = self.middleware()
+            self.assertFalse(any(middleware.should_profile(self.request()) for _ in range(100)))
+        with self.settings(PROFILING_SAMPLE_RATE=1):
+            middleware = self.middleware()
+            self.assertTrue(all(middleware.should_profile(self.request()) for _ in range(100)))
+
+    def test_collapse_frame_from_root_to_leaf(self):
+        def leaf():
+            return collapse_frame(sys._getframe())
+
+        def caller():
+            return leaf()
+
+        frames = caller().split(";")
+
+        self.assertTrue(frames[-1].startswith("leaf (tests.py:"))
+        self.assertTrue(frames[-2].startswith("caller (tests.py:"))
+        self.assertTrue(frames[-3].startswith("test_collapse_frame_from_root_to_leaf (tests.py:"))
+        self.assertTrue(frames[0].startswith("<module> "))
+
+    def test_profiled_request_writes_stacks(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                self.settings(PROFILING_DIR=directory, PROFILING_INTERVAL=0.001):
+            def view(request):
+                threading.Event().wait(0.05)
+                return JsonResponse({})
+
+            ProfilingMiddleware(view)(self.request("секрет-token"))
+
+            files = os.listdir(directory)
+            self.assertEqual(files, [f"unresolved.{os.getpid()}.collapsed"])
+
+
+class ProfileReportTestCase(SimpleTestCase):
+
+    def test_merges_files_of_all_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            files = {
+                "ads.views.AdListView.101.collapsed": "main;get;query 3\nmain;get 1\n",
+                "ads.views.AdListView.102.collapsed": "main;get;query 2\n",
+                "ads.views.root.101.collapsed": "main;root 5\n",
+            }
+            for name, content in files.items():
+                with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+                    f.write(content)
+            out = os.path.join(directory, "merged")
+
+            stdout = StringIO()
+            call_command("profile_report", dir=directory, out=out, stdout=stdout)
+
+            self.assertEqual(sorted(os.listdir(out)), ["ads.views.AdListView.collapsed", "ads.views.root.collapsed"])
+            with open(os.path.join(out, "ads.views.AdListView.collapsed"), encoding="utf-8") as f:
+                self.assertEqual(f.read(), "main;get;query 5\nmain;get 1\n")
+            self.assertIn("ads.views.AdListView: 6 samples", stdout.getvalue())
+            self.assertIn("83.3%  query", stdout.getvalue())
+
+            # --clear удаляет только склеенные файлы
+            call_command("profile_report", dir=directory, view="root", clear=True, stdout=StringIO())
+            self.assertEqual(sorted(os.listdir(directory)), [
+                "ads.views.AdListView.101.collapsed", "ads.views.AdListView.102.collapsed", "merged"
+            ])
+
+
+@override_settings(RANKING_TOP_N=2)
+class RankingTestCase(TestCase):
+
+    def setUp(self):
+        self.cats, self.dogs = Category.objects.create(name="Котики"), Category.objects.create(name="Собаки")
+        self.ads = [self.create_ad(f"ad{i}", price, self.cats) for i, price in enumerate([300, 100, 200])]
+
+    def create_ad(self, name, price, category, is_published=True):
+        ad = Ad.objects.create(name=name, price=price, is_published=is_published)
+        ad.categories.add(category)
+        return ad
+
+    def rows(self):
+        return list(AdRanking.objects.order_by("category_id", "kind", "position").values_list(
+            "category_id", "kind", "position", "ad_id", "ad_name", "ad_price"
+        ))
+
+    def assert_matches_rebuild(self):
+        rows = self.rows()
+        rankings.rebuild()
+        self.assertEqual(rows, self.rows())
+        return rows
+
+    def top(self, category, kind):
+        return list(AdRanking.objects.filter(category=category, kind=kind).order_by("position").values_list(
+            "ad_id", flat=True
+        ))
+
+    def test_initial_rows(self):
+        self.assert_matches_rebuild()
+        self.assertEqual(self.top(self.cats, AdRanking.PRICE), [self.ads[1].pk, self.ads[2].pk])
+        self.assertEqual(self.top(self.cats, AdRanking.RECENT), [self.ads[2].pk, self.ads[1].pk])
+        self.assertEqual(self.top(self.dogs, AdRanking.PRICE), [])
+
+    def test_ad_changes(self):
+        ad = self.ads[0]
+        ad.price = 50
+        ad.save()
+        self.assert_matches_rebuild()
+        self.assertEqual(self.top(self.cats, AdRanking.PRICE), [ad.pk, self.ads[1].pk])
+
+        ad.name = "renamed"
+        ad.save()
+        self.assertIn("renamed", [row[4] for row in self.assert_matches_rebuild()])
+
+        ad.is_published = False
+        ad.save()
+        self.assert_matches_rebuild()
+        self.assertNotIn(ad.pk, self.top(self.cats, AdRanking.PRICE))
+
+        self.create_ad("hidden", 1, self.cats, is_published=False)
+        self.assert_matches_rebuild()
+
+        self.ads[1].delete()
+        self.assert_matches_rebuild()
+        self.assertEqual(self.top(self.cats, AdRanking.PRICE), [self.ads[2].pk])
+
+    def test_category_changes_from_ad_side(self):
+        ad = self.ads[1]
+        ad.categories.add(self.dogs)
+        self.assert_matches_rebuild()
+        self.assertEqual(self.top(self.dogs, AdRanking.PRICE), [ad.pk])
+
+        ad.categories.remove(self.cats)
+        self.assert_matches_rebuild()
+        self.assertNotIn(ad.pk, self.top(self.cats, AdRanking.PRICE))
+
+        ad.categories.clear()
+        self.assert_matches_rebuild()
+        self.assertEqual(self.top(self.dogs, AdRanking.PRICE), [])
+
+    def test_category_changes_from_category_side(self):
+        self.dogs.ad_set.add(self.ads[0], self.ads[2])
+        self.assert_matches_rebuild()
+        self.assertEqual(self.top(self.dogs, AdRanking.PRICE), [self.ads[2].pk, self.ads[0].pk])
+
+        self.dogs.ad_set.remove(self.ads[2])
+        self.assert_matches_rebuild()
+        self.assertEqual(self.top(self.dogs, AdRanking.PRICE), [self.ads[0].pk])
+
+        self.cats.ad_set.clear()
+        self.assert_matches_rebuild()
+        self.assertEqual(self.top(self.cats, AdRanking.PRICE), [])
+
+        self.dogs.delete()
+        self.assertEqual(self.assert_matches_rebuild(), [])
+
+    def test_rank_category_locks_category_row(self):
+        locks = []
+
+        def select_for_update(queryset, *args, **kwargs):
+            locks.append((queryset.model, connection.in_atomic_block))
+            return queryset
+
+        with mock.patch("django.db.models.query.QuerySet.select_for_update", autospec=True,
+                        side_effect=select_for_update):
+            rankings.rank_category(self.cats.pk)
+            rankings.rank_category(0)
+
+        self.assertEqual(locks, [(Category, True), (Category, True)])
+        self.assertFalse(AdRanking.objects.filter(category_id=0).exists())
+
+    def test_top_view(self):
+        response = self.client.get("/cat/top/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"items": [
+            {"id": self.cats.pk, "name": "Котики", "ads": [
+                {"id": self.ads[1].pk, "name": "ad1", "price": 100},
+                {"id": self.ads[2].pk, "name": "ad2", "price": 200},
+            ]},
+        ]})
+
+        self.dogs.ad_set.add(self.ads[0])
+        response = self.client.get(f"/cat/{self.dogs.pk}/top/", {"by": "recent"})
+        self.assertEqual(response.json(), {"items": [
+            {"id": self.dogs.pk, "name": "Собаки", "ads": [{"id": self.ads[0].pk, "name": "ad0", "price": 300}]},
+        ]})
+
+        response = self.client.get("/cat/top/", {"by": "rating"})
+        self.assertEqual(response.status_code, 422)
+        self.assertIn("by", response.json())
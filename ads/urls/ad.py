@@ -4,7 +4,9 @@ from ads import views
 
 urlpatterns = [
     path('', views.AdListView.as_view()),
+    path('stats/', views.AdStatsView.as_view()),
     path('<int:pk>/', views.AdDetailView.as_view()),
+    path('<int:pk>/similar/', views.AdSimilarView.as_view()),
     path('create/', views.AdCreateView.as_view()),
     path('<int:pk>/update/', views.AdUpdateView.as_view()),
     path('<int:pk>/upload_image/', views.AdImageView.as_view()),
@@ -5,6 +5,9 @@ from ads import views
 urlpatterns = [
     path('', views.CategoryListView.as_view()),
     path('<int:pk>/', views.CategoryDetailView.as_view()),
+    path('suggest/', views.CategorySuggestView.as_view()),
+    path('top/', views.CategoryTopView.as_view()),
+    path('<int:pk>/top/', views.CategoryTopView.as_view()),
     path('create/', views.CategoryCreateView.as_view()),
     path('<int:pk>/update/', views.CategoryUpdateView.as_view()),
     path('<int:pk>/delete/', views.CategoryDeleteView.as_view()),
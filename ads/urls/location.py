@@ -0,0 +1,7 @@
+from django.urls import path
+
+from ads import views
+
+urlpatterns = [
+    path('suggest/', views.LocationSuggestView.as_view()),
+]
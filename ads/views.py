@@ -1,5 +1,6 @@
 import json
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator
 from django.http import JsonResponse
@@ -9,8 +10,34 @@ from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import DetailView, UpdateView, ListView, CreateView, DeleteView
 
-from ads.models import Category, Ad, AdUser, Location
-from avito import settings
+from ads.analytics import current_snapshot, price_stats
+from ads.duplicates import similar_ads, update_signature
+from ads.limits import limiters
+from ads.media import hash_upload
+from ads.models import Category, Ad, AdUser, Location, AdRanking
+from ads.singleflight import coalesce, flight
+from ads.suggest import category_index, location_index
+
+
+def paginate(request, object_list):
+    """
+    Пагинатор и страница с жёстким ограничением номера (MAX_PAGE_NUMBER) и
+    размера (?page_size, не больше MAX_PAGE_SIZE) страницы
+    """
+    page_number = request.GET.get("page")
+    if page_number and page_number.isdigit() and int(page_number) > settings.MAX_PAGE_NUMBER:
+        raise ValidationError({"page": [f"Ensure this value is less than or equal to {settings.MAX_PAGE_NUMBER}."]})
+
+    page_size = request.GET.get("page_size", settings.TOTAL_ON_PAGE)
+    try:
+        page_size = int(page_size)
+    except ValueError:
+        raise ValidationError({"page_size": ["Enter a whole number."]})
+    if page_size < 1:
+        raise ValidationError({"page_size": ["Ensure this value is greater than or equal to 1."]})
+
+    paginator = Paginator(object_list, min(page_size, settings.MAX_PAGE_SIZE))
+    return paginator, paginator.get_page(page_number)
 
 
 def root(request):
@@ -19,6 +46,18 @@ def root(request):
     })
 
 
+def metrics(request):
+    return JsonResponse({
+        "singleflight": flight.stats,
+        "limits": {name: limiter.stats for name, limiter in limiters.items()}
+    })
+
+
+# служебные эндпоинты не ограничиваем, иначе под нагрузкой отвалятся health-checks
+root.endpoint_class = None
+metrics.endpoint_class = None
+
+
 class CategoryListView(ListView):
     """
     Список категорий, с сортировкой по названию категории, с пагинатором и
@@ -31,9 +70,10 @@ class CategoryListView(ListView):
 
         self.object_list = self.object_list.order_by("name")
 
-        paginator = Paginator(self.object_list, settings.TOTAL_ON_PAGE)
-        page_number = request.GET.get("page")
-        page_obj = paginator.get_page(page_number)
+        try:
+            paginator, page_obj = paginate(request, self.object_list)
+        except ValidationError as e:
+            return JsonResponse(e.message_dict, status=422)
 
         categories = []
         for category in page_obj:
@@ -68,6 +108,77 @@ class CategoryDetailView(DetailView):
         })
 
 
+class CategoryTopView(View):
+    """
+    Топ объявлений по категориям (?by=price -- самые дешёвые, ?by=recent --
+    самые новые) из предрассчитанной таблицы AdRanking, одним запросом
+    """
+
+    def get(self, request, pk=None, *args, **kwargs):
+        kind = request.GET.get("by", AdRanking.PRICE)
+        if kind not in dict(AdRanking.KINDS):
+            return JsonResponse({"by": [f"Value must be one of: {', '.join(dict(AdRanking.KINDS))}."]}, status=422)
+
+        rows = AdRanking.objects.filter(kind=kind).order_by("category_id", "position")
+        if pk is not None:
+            rows = rows.filter(category_id=pk)
+
+        categories = {}
+        for row in rows.values("category_id", "category__name", "ad_id", "ad_name", "ad_price"):
+            category = categories.setdefault(row["category_id"], {
+                "id": row["category_id"],
+                "name": row["category__name"],
+                "ads": []
+            })
+            category["ads"].append(
+                {
+                    "id": row["ad_id"],
+                    "name": row["ad_name"],
+                    "price": row["ad_price"]
+                }
+            )
+
+        return JsonResponse({"items": list(categories.values())})
+
+
+class SuggestView(View):
+    """
+    Подсказки по мере ввода: первые limit записей, название которых (или любое
+    слово в нём) начинается с q, по убыванию числа опубликованных объявлений
+    """
+    index = None
+    # индекс в памяти процесса, БД нужна только при перестроении раз в SUGGEST_INDEX_TTL
+    endpoint_class = None
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(int(request.GET.get("limit", settings.SUGGEST_LIMIT)), settings.SUGGEST_MAX_LIMIT)
+        except ValueError:
+            return JsonResponse({"limit": ["Enter a whole number."]}, status=422)
+
+        self.index.ensure_built()
+
+        items = []
+        for pk, name, ads_count in self.index.search(request.GET.get("q", ""), limit):
+            items.append(
+                {
+                    "id": pk,
+                    "name": name,
+                    "ads_count": ads_count
+                }
+            )
+
+        return JsonResponse({"items": items})
+
+
+class CategorySuggestView(SuggestView):
+    index = category_index
+
+
+class LocationSuggestView(SuggestView):
+    index = location_index
+
+
 @method_decorator(csrf_exempt, name="dispatch")
 class CategoryCreateView(CreateView):
     """
@@ -150,6 +261,7 @@ class CategoryDeleteView(DeleteView):
 
 
 
+@method_decorator(coalesce, name="get")
 class AdListView(ListView):
     """
     Список всех объявлений, с сортировкой по цене объявления по убыванию, с пагинатором и
@@ -162,9 +274,10 @@ class AdListView(ListView):
 
         self.object_list = self.object_list.order_by("-name")
 
-        paginator = Paginator(self.object_list, settings.TOTAL_ON_PAGE)
-        page_number = request.GET.get("page")
-        page_obj = paginator.get_page(page_number)
+        try:
+            paginator, page_obj = paginate(request, self.object_list)
+        except ValidationError as e:
+            return JsonResponse(e.message_dict, status=422)
 
         ads = []
         for ad in page_obj:
@@ -191,6 +304,7 @@ class AdListView(ListView):
         return JsonResponse(response, safe=False)
 
 
+@method_decorator(coalesce, name="get")
 class AdDetailView(DetailView):
     """
     Детальная информация по выбранному объявлению
@@ -213,6 +327,90 @@ class AdDetailView(DetailView):
         })
 
 
+class AdStatsView(View):
+    """
+    Статистика цен по категориям или адресам (?by=category|location): число
+    объявлений, среднее, перцентили (?q=25,50,75) и гистограмма (?bins=10)
+    по колоночному снимку, без запросов к ads_ad
+    """
+    endpoint_class = None
+
+    def get(self, request, *args, **kwargs):
+        by = request.GET.get("by", "category")
+        if by not in ("category", "location"):
+            return JsonResponse({"by": ["Value must be one of: category, location."]}, status=422)
+        errors = {}
+        try:
+            percentiles = [float(q) for q in request.GET.get("q", "25,50,75,90").split(",")]
+            if not all(0 <= q <= 100 for q in percentiles):
+                errors["q"] = ["Values must be between 0 and 100."]
+        except ValueError:
+            errors["q"] = ["Enter comma-separated numbers."]
+        try:
+            bins = int(request.GET.get("bins", 10))
+            if not 1 <= bins <= settings.ANALYTICS_MAX_BINS:
+                errors["bins"] = [f"Value must be between 1 and {settings.ANALYTICS_MAX_BINS}."]
+        except ValueError:
+            errors["bins"] = ["Enter a whole number."]
+        if errors:
+            return JsonResponse(errors, status=422)
+
+        snapshot = current_snapshot()
+        if snapshot is None:
+            return JsonResponse({"error": "Price snapshot is not built, run manage.py refresh_price_snapshot"},
+                                status=503)
+
+        published = request.GET.get("published", "1") != "0"
+        keys, counts, values, means, histogram, edges = price_stats(snapshot, by, percentiles, bins, published)
+
+        if by == "category":
+            names = dict(Category.objects.filter(pk__in=keys.tolist()).values_list("id", "name"))
+        else:
+            names = dict(enumerate(snapshot.locations))
+
+        items = []
+        for i, key in enumerate(keys.tolist()):
+            items.append(
+                {
+                    "id": key if by == "category" else None,
+                    "name": names.get(key),
+                    "count": int(counts[i]),
+                    "mean": round(float(means[i]), 2),
+                    "percentiles": {f"{q:g}": round(float(v), 2) for q, v in zip(percentiles, values[i])},
+                    "histogram": histogram[i].tolist()
+                }
+            )
+
+        return JsonResponse({
+            "items": items,
+            "bin_edges": [round(float(edge), 2) for edge in edges],
+            "snapshot_at": snapshot.meta["watermark"]
+        })
+
+
+class AdSimilarView(DetailView):
+    """
+    Похожие объявления (возможные дубликаты) по MinHash-сигнатуре текста
+    """
+    model = Ad
+
+    def get(self, request, *args, **kwargs):
+        ad = self.get_object()
+
+        ads = []
+        for similar, score in similar_ads(ad, settings.DUPLICATE_THRESHOLD, settings.TOTAL_ON_PAGE):
+            ads.append(
+                {
+                    "id": similar.id,
+                    "name": similar.name,
+                    "price": similar.price,
+                    "similarity": round(score, 3)
+                }
+            )
+
+        return JsonResponse({"items": ads})
+
+
 @method_decorator(csrf_exempt, name="dispatch")
 class AdCreateView(CreateView):
     """
@@ -250,6 +448,7 @@ class AdCreateView(CreateView):
             ad_new.categories.add(category_obj)
 
         ad_new.save()
+        update_signature(ad_new)
 
         return JsonResponse({
             "id": ad_new.id,
@@ -301,6 +500,7 @@ class AdUpdateView(UpdateView):
             return JsonResponse(e.message_dict, status=422)
 
         self.object.save()
+        update_signature(self.object)
 
         # ad_upd = Ad.objects.create(
         #     name=ad_data["name"],
@@ -332,7 +532,7 @@ class AdImageView(UpdateView):
 
     def post(self, request, *args, **kwargs):
         self.object = self.get_object()
-        self.object.logo = request.FILES["logo"]
+        self.object.logo = hash_upload(request.FILES["logo"], self.object.logo)
 
         self.object.save()
 
@@ -373,9 +573,10 @@ class AdUserListView(ListView):
 
         self.object_list = self.object_list.order_by("username")
 
-        paginator = Paginator(self.object_list, settings.TOTAL_ON_PAGE)
-        page_number = request.GET.get("page")
-        page_obj = paginator.get_page(page_number)
+        try:
+            paginator, page_obj = paginate(request, self.object_list)
+        except ValidationError as e:
+            return JsonResponse(e.message_dict, status=422)
 
         ad_users = []
         for ad_user in page_obj:
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ads.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'ads.limits.LoadSheddingMiddleware',
 ]
 
 ROOT_URLCONF = 'avito.urls'
@@ -132,3 +134,62 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 TOTAL_ON_PAGE = 5
 
+
+# Профилирование запросов, см. ads/profiling.py и manage.py profile_report
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED") == "1"
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN")
+PROFILING_INTERVAL = 0.005
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# Схлопывание одинаковых одновременных запросов, см. ads/singleflight.py.
+# Межпроцессный режим имеет смысл только с общим для воркеров CACHES (redis/memcached)
+SINGLEFLIGHT_CROSS_PROCESS = False
+SINGLEFLIGHT_LOCK_TIMEOUT = 10
+SINGLEFLIGHT_RESULT_TTL = 1
+SINGLEFLIGHT_POLL_INTERVAL = 0.02
+
+# Подсказки /cat/suggest/ и /location/suggest/, см. ads/suggest.py.
+# Индекс у каждого воркера свой, TTL -- через сколько секунд перестроить его
+# целиком, чтобы подтянуть изменения, сделанные в других воркерах
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+SUGGEST_INDEX_TTL = 300
+
+# Сколько объявлений хранить в топе каждой категории, см. ads/rankings.py
+RANKING_TOP_N = 10
+
+# Раздача MEDIA_ROOT, см. ads/media.py. MEDIA_SENDFILE_BACKEND: None -- отдаёт
+# Django (FileResponse), "nginx" -- X-Accel-Redirect на internal-location
+# MEDIA_ACCEL_PREFIX, "apache" -- X-Sendfile с абсолютным путём
+MEDIA_SENDFILE_BACKEND = None
+MEDIA_ACCEL_PREFIX = "/protected-media/"
+MEDIA_CACHE_MAX_AGE = 3600
+
+# С какого размера таблицы админка показывает оценку числа строк вместо COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# Поиск похожих объявлений (MinHash + LSH), см. ads/duplicates.py.
+# 32 полосы по 4 строки: пара с сходством 0.5 становится кандидатом с
+# вероятностью ~0.88, с 0.2 -- ~0.05
+MINHASH_PERMUTATIONS = 128
+MINHASH_BANDS = 32
+DUPLICATE_THRESHOLD = 0.5
+
+# Сброс нагрузки, см. ads/limits.py: сколько запросов каждого класса
+# одновременно обрабатывает один процесс и бюджет на SQL-запрос в мс.
+# Класс вьюхи задаётся атрибутом endpoint_class, по умолчанию read/write по методу
+ENDPOINT_LIMITS = {
+    "read": {"concurrency": 32, "statement_timeout": 2000},
+    "write": {"concurrency": 8, "statement_timeout": 5000},
+    "export": {"concurrency": 2, "statement_timeout": 30000},
+}
+LOAD_SHEDDING_RETRY_AFTER = 1
+MAX_PAGE_NUMBER = 1000
+MAX_PAGE_SIZE = 100
+
+# Снимок цен для /ad/stats/, см. ads/analytics.py и manage.py refresh_price_snapshot
+ANALYTICS_DIR = os.path.join(BASE_DIR, 'analytics')
+ANALYTICS_CHUNK_SIZE = 10000
+ANALYTICS_REFRESH_OVERLAP = 60
+ANALYTICS_MAX_BINS = 100
@@ -0,0 +1,28 @@
+"""
+Облегчённый профиль настроек для API-воркеров.
+
+Все эндпоинты ads отдают JSON и помечены csrf_exempt, поэтому админка,
+сессии, сообщения, CSRF и шаблонизатор в воркерах не нужны.
+Запуск: DJANGO_SETTINGS_MODULE=avito.settings_api
+"""
+from avito.settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'ads',
+]
+
+MIDDLEWARE = [
+    'ads.profiling.ProfilingMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'ads.limits.LoadSheddingMiddleware',
+]
+
+TEMPLATES = []
+
+AUTH_PASSWORD_VALIDATORS = []
+
+# Постоянные соединения с БД вместо нового подключения на каждый запрос,
+# перед повторным использованием соединение проверяется (CONN_HEALTH_CHECKS)
+DATABASES['default']['CONN_MAX_AGE'] = 600  # noqa: F405
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True  # noqa: F405
@@ -13,22 +13,26 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.apps import apps
 from django.conf import settings
-from django.conf.urls.static import static
-from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 
-from ads import views
+from ads import media, views
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('', views.root),
+    path('metrics/', views.metrics),
     path('ad/', include('ads.urls.ad')),
     path('cat/', include('ads.urls.cat')),
     path('user/', include('ads.urls.user')),
+    path('location/', include('ads.urls.location')),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns += [path('admin/', admin.site.urls)]
+
+urlpatterns += [re_path(r'^%s/(?P<path>.*)$' % settings.MEDIA_URL.strip('/'), media.serve)]
 
 
@@ -0,0 +1,89 @@
+"""
+Бенчмарк холодного старта и накладных расходов middleware.
+
+Для каждого профиля настроек запускает отдельный интерпретатор, замеряет время
+до готового WSGI-приложения и среднее время запроса к "/" через весь стек
+middleware в сравнении с прямым вызовом вьюхи.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --settings avito.settings avito.settings_api --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+from avito.wsgi import application
+ready = time.perf_counter() - started
+
+from io import BytesIO
+from django.test import RequestFactory
+from ads.views import root
+
+environ = {
+    "REQUEST_METHOD": "GET", "PATH_INFO": "/", "QUERY_STRING": "",
+    "SERVER_NAME": "localhost", "SERVER_PORT": "80", "HTTP_HOST": "localhost",
+    "wsgi.url_scheme": "http", "wsgi.input": BytesIO(), "wsgi.errors": sys.stderr,
+}
+
+def start_response(status, headers, exc_info=None):
+    assert status.startswith("200"), status
+
+requests = int(sys.argv[1])
+for _ in range(100):
+    b"".join(application(dict(environ), start_response))
+
+t = time.perf_counter()
+for _ in range(requests):
+    b"".join(application(dict(environ), start_response))
+stack = (time.perf_counter() - t) / requests
+
+request = RequestFactory().get("/")
+t = time.perf_counter()
+for _ in range(requests):
+    root(request)
+view = (time.perf_counter() - t) / requests
+
+print(json.dumps({"ready": ready, "stack": stack, "view": view}))
+"""
+
+
+def run_once(settings_module, requests):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, str(requests)],
+        cwd=BASE_DIR, env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    result = json.loads(output.splitlines()[-1])
+    result["process"] = time.perf_counter() - started
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--settings", nargs="+", default=["avito.settings", "avito.settings_api"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'settings':<24}{'process, ms':>14}{'app ready, ms':>16}{'request, us':>14}{'middleware, us':>17}")
+    for settings_module in args.settings:
+        runs = [run_once(settings_module, args.requests) for _ in range(args.runs)]
+        process = statistics.median(r["process"] for r in runs) * 1000
+        ready = statistics.median(r["ready"] for r in runs) * 1000
+        stack = statistics.median(r["stack"] for r in runs) * 1e6
+        view = statistics.median(r["view"] for r in runs) * 1e6
+        print(f"{settings_module:<24}{process:>14.1f}{ready:>16.1f}{stack:>14.1f}{stack - view:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()